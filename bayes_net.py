@@ -1,13 +1,27 @@
+import compiled
 import copy
+import hashlib
 import json
+import math
+import os
 import random
 
-from collections import defaultdict
-from random import choice
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
 
+from chain import Chain
 from constants import NODES, RELATIONS, PARENTS, PROBABILITIES, REQUIRED_KEYS
+from constants import UNIFORMS_BATCH, SAMPLES_CHUNK
+from factor import Factor, elimination_order
+from junction_tree import JunctionTree
+from mb_cache import MarkovBlanketCache
 from node import Node
 from utils import check_file, check_json, split_key, quicksort
+from utils import draw, max_standard_error, normalize
+from utils import make_rng, rng_batch, spawn
 from utils import ConditionalProbability
 
 
@@ -17,6 +31,24 @@ class BayesNet:
     def __init__(self):
         self.nodes = {}
         self.edges = defaultdict(list)
+        self.order = []  # names of nodes, in order of their indices
+        self.index = {}  # maps names of nodes to their indices
+        self.topological = None  # cached by topological_order
+        self.blankets = {}  # Markov blankets cached by markov_blanket
+        self.pruned = {}  # networks cached by prune
+        self.pruned_size = 128
+        # factors cached by query_exact, least recently used first:
+        self.factor_cache = OrderedDict()
+        self.factor_cache_size = 1024
+        self.junction_tree = None  # compiled by query_junction_tree
+        self.source = None   # json file the network was loaded from
+        self.mapping = None  # file mapped into memory by load_compiled
+        self.digest = None   # cached by fingerprint
+        self.log_tables = None  # cached by log_likelihood
+        # worker processes of parallel_mcmc, holding a copy of the network
+        # identified by pool_key:
+        self.pool = None
+        self.pool_key = None
 
     def __str__(self):
         msg = ''
@@ -31,78 +63,819 @@ class BayesNet:
             msg += str(edge) + '\n'
         return msg
 
-    def load(self, filename):
+    def load(self, filename, compact=False):
+        """Loads the network from a json file. When compact is True,
+        nodes are switched to compact storage after compilation."""
+        self.source = filename
         self.nodes = self._load_json(filename)
         self._connect()
-        valid, err_msg = self.validate()
+        # nodes have been validated by _load_json already:
+        valid, err_msg = self.validate(nodes=False)
         if not valid:
             print('BayesNet invalid.')
             print(err_msg)
             return False
+        self.compile()
+        if compact:
+            self.compact()
         return True
 
-    def mcmc(self, ev={}, query=[], steps=1000):
+    def save_compiled(self, path):
+        """Writes the compiled network into a binary file, stamped with
+        modification time and hash of the json file it was loaded
+        from."""
+        compiled.save_compiled(self, path, self.source)
+
+    def load_compiled(self, path, source=None):
+        """Loads the network from a binary file written by save_compiled,
+        mapping its tables into memory. Evaluates to False if the file
+        cannot be used, in particular if source, the json file the
+        network was loaded from, has changed since."""
+        if not compiled.load_compiled(self, path, source):
+            return False
+        self.source = source
+        self.edges = defaultdict(list)
+        self._connect()
+        self.compile(tables=False)
+        return True
+
+    def load_cached(self, filename, path=None):
+        """Loads the network from its compiled file, path defaulting to
+        filename with .bnc appended. If the compiled file is missing or
+        outdated, the network is loaded from json and compiled file is
+        written anew; save_compiled renames the complete file into place,
+        so processes sharing the cache never map a partial one."""
+        path = path or filename + '.bnc'
+        if self.load_compiled(path, filename):
+            return True
+        if not self.load(filename):
+            return False
+        self.save_compiled(path)
+        return True
+
+    def __getstate__(self):
+        """Returns state for pickling, without the mapped file and the
+        pool of workers."""
+        state = self.__dict__.copy()
+        state['mapping'] = None
+        state['pool'] = state['pool_key'] = None
+        return state
+
+    def mcmc(self, ev={}, query=[], steps=1000, cache_size=0,
+             instrumentation=None, rng=None, prune=False,
+             schedule='random', blocks=None):
         """Returns probability estimates for each query,
-        based on provided evidence."""
-        evidence = copy.copy(ev)
+        based on provided evidence. When cache_size is positive, up to
+        cache_size conditional distributions per node are cached,
+        keyed by the state of node's Markov blanket. When
+        an Instrumentation is given, statistics of the run are recorded
+        in it. Random numbers are drawn from rng, a seed or a Random
+        instance, see utils.make_rng. When prune is True, the chain runs
+        on the network pruned to nodes relevant to the query.
+        The schedule of updates is one of:
+            random     - a node drawn uniformly in every step;
+            systematic - sweeps over nodes in topological order;
+            blocked    - a block drawn uniformly in every step, and its
+                         nodes sampled jointly; blocks are lists of names
+                         of nodes, by default pairs of nodes and their
+                         children, see gibbs_blocks.
+        Raises ValueError unless steps is positive."""
+        if steps < 1:
+            raise ValueError('steps must be positive, got ' + str(steps))
+        if prune:
+            bayes_net = self.prune(ev, query)
+            if all(n in ev for n in bayes_net.nodes):
+                # nothing left to sample, all the queries are evidence:
+                return {q: {v: float(v == ev[q])
+                            for v in self.nodes[q].values} for q in query}
+            return bayes_net.mcmc({n: v for n, v in ev.items()
+                                   if n in bayes_net.nodes}, query, steps,
+                                  cache_size, instrumentation, rng,
+                                  schedule=schedule, blocks=blocks)
+        rng = make_rng(rng)
+        ins = instrumentation
+        phase = ins.phase if ins is not None else lambda name: nullcontext()
+        with phase('init'):
+            cache = (MarkovBlanketCache(self, cache_size) if cache_size
+                     else None)
+            state, unknown = self._initial_state(ev, rng)
+            # Set the counters for variables of interest:
+            counts = {q: [0] * len(self.nodes[q].values) for q in query}
+            query_ids = [(self.index[q], counts[q]) for q in query]
+            if schedule == 'systematic':
+                position = {n: i for i, n
+                            in enumerate(self.topological_order())}
+                units = [(x,) for x in sorted(
+                    unknown, key=lambda x: position[self.order[x]])]
+            elif schedule == 'blocked':
+                if blocks is None:
+                    blocks = self.gibbs_blocks(ev)
+                units = [tuple(self.index[n] for n in b if n not in ev)
+                         for b in blocks]
+                units = [u for u in units if u]
+                blocked = {x for u in units for x in u}
+                units += [(x,) for x in unknown if x not in blocked]
+            elif schedule == 'random':
+                units = [(x,) for x in unknown]
+            else:
+                raise ValueError('unknown schedule ' + str(schedule))
+            setup = self._gibbs_setup(units, cache)
+        record = None
+        if ins is not None:
+            def record(unit, changed, lookups):
+                ins.record([self.order[x] for x in unit], changed,
+                           {q: self.nodes[q].values[state[i]]
+                            for q, (i, _) in zip(query, query_ids)},
+                           lookups)
+        with phase('sampling'):
+            self._gibbs(state, units, query_ids, steps, cache, rng,
+                        schedule == 'systematic', setup, record)
+        # Normalize counters to get a probability distribution:
+        with phase('normalization'):
+            answer = self._counters(counts)
+        if ins is not None:
+            ins.finish()
+        return answer
+
+    def _initial_state(self, ev, rng=random):
+        """Returns initial state of a chain, value indices of all the
+        nodes, with evidence set and other values drawn uniformly from
+        rng, and indices of the nodes not belonging to evidence."""
+        state = [0] * len(self.order)
+        for n, v in ev.items():
+            state[self.index[n]] = self.nodes[n].value_index[v]
         # list of all nodes for whom there no evidence was provided:
-        unknown = [n for n in self.nodes.keys() if n not in evidence.keys()]
+        unknown = [self.index[n] for n in self.order if n not in ev]
         for u in unknown:
-            evidence[u] = self.random(u)
-        # Set the counters for variables of interest:
+            state[u] = self.nodes[self.order[u]].value_index[
+                self.random(self.order[u], rng)]
+        return state, unknown
+
+    def _gibbs_setup(self, units, cache=None):
+        """Returns tables used by _gibbs to update the units: factors
+        of single nodes, plans of blocks, numbers of values of all the
+        nodes and, if cache is given, Markov blankets of single nodes."""
+        unknown = [u[0] for u in units if len(u) == 1]
+        factors = {x: self._factors(x) for x in unknown}
+        plans = {u: self._block_plan(u) for u in units if len(u) > 1}
+        n_values = [len(self.nodes[n].values) for n in self.order]
+        blankets = {x: [self.index[n]
+                        for n in self.markov_blanket(self.order[x])]
+                    for x in unknown} if cache is not None else None
+        return factors, plans, n_values, blankets
+
+    def _gibbs(self, state, units, query_ids, steps, cache=None,
+               rng=random, systematic=False, setup=None, record=None):
+        """Performs steps of Gibbs sampling on the state, a list of
+        value indices of all the nodes, counting values of queried
+        nodes, given as pairs of node's index and its counts. Every step
+        updates a unit, a tuple of indices of nodes sampled jointly,
+        drawn uniformly from units or, if systematic, taken in turn.
+        Single nodes are updated without allocating objects, but for
+        distributions stored in the MarkovBlanketCache; uniform numbers
+        are drawn from rng in batches of UNIFORMS_BATCH steps. Setup,
+        returned by _gibbs_setup, can be shared by runs on the same
+        units. When record is given, it is called after every step with
+        the unit, whether its values changed and the number of table
+        lookups made."""
+        if not units:
+            for i, count in query_ids:
+                count[state[i]] += steps
+            return
+        factors, plans, n_values, blankets = (
+            setup or self._gibbs_setup(units, cache))
+        # scratch buffer of cumulative weights of node's values:
+        weights = [0.0] * max(n_values)
+        n_units = len(units)
+        uniforms = []
+        for s in range(steps):
+            if not uniforms:
+                uniforms = rng_batch(rng,
+                                     2 * min(steps - s, UNIFORMS_BATCH))
+            # Draw a unit of nodes not belonging to evidence:
+            uniform = uniforms.pop()
+            unit = units[s % n_units if systematic
+                         else int(uniform * n_units)]
+            if len(unit) > 1:
+                if record is not None:
+                    previous = [state[i] for i in unit]
+                self._sample_block(unit, plans[unit], state, uniforms.pop())
+                for i, count in query_ids:
+                    count[state[i]] += 1
+                if record is not None:
+                    assignments, tables = plans[unit]
+                    record(unit, previous != [state[i] for i in unit],
+                           len(assignments) * len(tables))
+                continue
+            x = unit[0]
+            n = n_values[x]
+            previous = state[x]
+            totals = None
+            if cache is not None:
+                key = tuple([state[i] for i in blankets[x]])
+                totals = cache.lookup(x, key)
+            lookups = 0
+            if totals is None:
+                totals = weights
+                for v in range(n):
+                    weights[v] = 1.0
+                for table, coefficient, others in factors[x]:
+                    base = 0
+                    for i, stride in others:
+                        base += state[i] * stride
+                    for v in range(n):
+                        weights[v] *= table[base + v * coefficient]
+                lookups = n * len(factors[x])
+                total = 0.0
+                for v in range(n):
+                    total += weights[v]
+                    weights[v] = total
+                if not total:
+                    raise ZeroDivisionError('evidence has zero probability')
+                if cache is not None:
+                    totals = weights[:n]
+                    cache.store(x, key, totals)
+            v = bisect_left(totals, uniforms.pop() * totals[n - 1], 0, n)
+            state[x] = v if v < n else n - 1
+            for i, count in query_ids:
+                count[state[i]] += 1
+            if record is not None:
+                record(unit, state[x] != previous, lookups)
+
+    def gibbs_blocks(self, ev={}):
+        """Returns default blocks of blocked Gibbs sampling: every node
+        not belonging to evidence, taken in topological order, paired
+        with its first child that is neither evidence nor in a block."""
+        blocks = []
+        blocked = set(ev)
+        for node in self.topological_order():
+            if node in blocked:
+                continue
+            blocked.add(node)
+            block = [node]
+            for child in self.edges[node]:
+                if child not in blocked:
+                    blocked.add(child)
+                    block.append(child)
+                    break
+            blocks.append(block)
+        return blocks
+
+    def _block_plan(self, block):
+        """Returns all joint value indices of the block's nodes and the
+        compiled tables of nodes depending on them, each one with
+        (index, stride) pairs of its variables."""
+        families = []
+        for i in block:
+            name = self.order[i]
+            for f in [name] + self.edges[name]:
+                if f not in families:
+                    families.append(f)
+        tables = []
+        for f in families:
+            node = self.nodes[f]
+            variables = [(self.index[p], s) for p, s in zip(node.parents,
+                                                            node.strides)]
+            tables.append((node.table, variables + [(self.index[f], 1)]))
+        assignments = list(product(*[range(len(self.nodes[
+            self.order[i]].values)) for i in block]))
+        return assignments, tables
+
+    def _sample_block(self, block, plan, state, uniform):
+        """Samples values of the block's nodes jointly, conditioned on
+        the rest of the state."""
+        assignments, tables = plan
+        totals = []
+        total = 0.0
+        for assignment in assignments:
+            for i, v in zip(block, assignment):
+                state[i] = v
+            weight = 1.0
+            for table, variables in tables:
+                offset = 0
+                for i, stride in variables:
+                    offset += state[i] * stride
+                weight *= table[offset]
+            total += weight
+            totals.append(total)
+        if not total:
+            raise ZeroDivisionError('evidence has zero probability')
+        k = bisect_left(totals, uniform * total)
+        for i, v in zip(block, assignments[min(k, len(assignments) - 1)]):
+            state[i] = v
+
+    def mcmc_iter(self, ev={}, query=[], every=1000, steps=None,
+                  burn_in=0, chain=None, cache_size=0, rng=None):
+        """Yields a Chain every given number of steps, so that running
+        estimates and their errors can be read from it. Sampling stops
+        after steps, or never if steps is None. A new chain discards
+        its first burn_in steps; a chain given is resumed instead,
+        with its own evidence and query."""
+        rng = make_rng(rng)
+        cache = MarkovBlanketCache(self, cache_size) if cache_size else None
+        if chain is None:
+            state, unknown = self._initial_state(ev, rng)
+            chain = Chain(state, unknown, list(query),
+                          {q: list(self.nodes[q].values) for q in query})
+            self._gibbs(state, [(x,) for x in unknown], [], burn_in,
+                        cache, rng)
+        units = [(x,) for x in chain.unknown]
+        setup = self._gibbs_setup(units, cache) if units else None
+        while steps is None or steps > 0:
+            n = every if steps is None else min(every, steps)
+            if steps is not None:
+                steps -= n
+            while n:
+                # count steps into the current batch of the chain:
+                k = min(n, chain.batch_size - chain.filled)
+                query_ids = [(self.index[q], chain.batch[q])
+                             for q in chain.query]
+                self._gibbs(chain.state, units, query_ids, k, cache, rng,
+                            setup=setup)
+                chain.add(k)
+                n -= k
+            yield chain
+
+    def mcmc_batch(self, requests, steps=1000, cache_size=0, rng=None):
+        """Returns probability estimates for a list of (evidence, query)
+        requests. Requests are grouped by evidence and a single chain is
+        run for each group, counting values of all the variables queried
+        within the group. Results are returned in order of requests."""
+        rng = make_rng(rng)
+        groups = {}  # union of queries for every evidence
+        for ev, query in requests:
+            union = groups.setdefault(tuple(sorted(ev.items())), [])
+            union += [q for q in query if q not in union]
+        answers = {}
+        for key, union in groups.items():
+            answers[key] = self.mcmc(dict(key), union, steps, cache_size,
+                                     rng=rng)
+        results = []
+        for ev, query in requests:
+            answer = answers[tuple(sorted(ev.items()))]
+            results.append({q: dict(answer[q]) for q in query})
+        return results
+
+    def mcmc_chains(self, ev={}, query=[], steps=1000, chains=100,
+                    rng=None):
+        """Returns probability estimates for each query, based on
+        provided evidence, pooled from a number of independent chains.
+        The state of every chain is a row of node value indices; in each
+        step the same node is updated in all the chains at once."""
+        if chains < 1:
+            raise ValueError('chains must be positive, got ' + str(chains))
+        rng = make_rng(rng)
+        states = []
+        for c in range(chains):
+            state, unknown = self._initial_state(ev, rng)
+            states.append(state)
+        if not unknown:
+            # nothing to sample, all the queries are evidence:
+            return {q: {v: float(v == ev[q])
+                        for v in self.nodes[q].values} for q in query}
+        factors, _, n_values, _ = self._gibbs_setup(
+            [(x,) for x in unknown])
+        # Counters of value indices for variables of interest:
+        counts = {q: [0] * len(self.nodes[q].values) for q in query}
+        query_ids = [(self.index[q], counts[q]) for q in query]
+        # scratch buffer of cumulative weights of node's values:
+        weights = [0.0] * max(n_values)
+        for s in range(steps):
+            x = rng.choice(unknown)  # Draw a node not in evidence
+            x_factors = factors[x]
+            n = n_values[x]
+            uniforms = rng_batch(rng, chains)
+            for state, uniform in zip(states, uniforms):
+                for v in range(n):
+                    weights[v] = 1.0
+                for table, coefficient, others in x_factors:
+                    base = 0
+                    for i, stride in others:
+                        base += state[i] * stride
+                    for v in range(n):
+                        weights[v] *= table[base + v * coefficient]
+                total = 0.0
+                for v in range(n):
+                    total += weights[v]
+                    weights[v] = total
+                if not total:
+                    raise ZeroDivisionError('evidence has zero probability')
+                v = bisect_left(weights, uniform * total, 0, n)
+                state[x] = v if v < n else n - 1
+            for i, count in query_ids:
+                for state in states:
+                    count[state[i]] += 1
+        return self._counters(counts)
+
+    def parallel_mcmc(self, ev={}, query=[], steps=1000, workers=None,
+                      seed=None):
+        """Returns probability estimates for each query, based on
+        provided evidence, obtained from independent chains run in
+        a pool of worker processes. The pool is started by the first
+        call and kept for later ones, until close(), so the network is
+        sent to every worker once; a new pool is started if the number
+        of workers or the compiled network changes. Steps are split
+        evenly between workers; each chain draws from its own stream,
+        spawned from seed, or from a random seed if seed is None."""
+        if steps < 1:
+            raise ValueError('steps must be positive, got ' + str(steps))
+        workers = workers or os.cpu_count() or 1
+        if seed is None:
+            seed = random.getrandbits(64)
+        chain_steps = [steps // workers + (i < steps % workers)
+                       for i in range(workers)]
+        chain_steps = [s for s in chain_steps if s]
+        counters = {q: dict.fromkeys(self.nodes[q].values, 0.0)
+                    for q in query}
+        key = (workers, self.fingerprint())
+        if self.pool_key != key:
+            self.close()
+            self.pool = ProcessPoolExecutor(max_workers=workers,
+                                            initializer=_init_worker,
+                                            initargs=(self,))
+            self.pool_key = key
+        futures = [self.pool.submit(_run_chain, ev, query, s, stream)
+                   for s, stream in zip(chain_steps,
+                                        spawn(seed, len(chain_steps)))]
+        for future, s in zip(futures, chain_steps):
+            # Turn estimates back into counts before merging:
+            for q, estimates in future.result().items():
+                for value, p in estimates.items():
+                    counters[q][value] += p * s
+        return normalize(counters)
+
+    def close(self):
+        """Shuts down the pool of workers of parallel_mcmc, if any."""
+        if self.pool is not None:
+            self.pool.shutdown()
+        self.pool = self.pool_key = None
+
+    def likelihood_weighting(self, ev={}, query=[], steps=1000,
+                             precision=None, check_every=100, rng=None):
+        """Returns probability estimates for each query, based on
+        provided evidence, from samples drawn in topological order with
+        evidence nodes fixed and each sample weighted by the likelihood
+        of the evidence. When precision is given, sampling stops as soon
+        as standard errors of all the estimates, checked every
+        check_every samples, fall below it, provided the effective
+        sample size has reached check_every. Raises ZeroDivisionError
+        if all the samples have zero weight."""
+        rng = make_rng(rng)
+        evidence = {self.index[n]: self.nodes[n].value_index[v]
+                    for n, v in ev.items()}
+        plan = self._sampling_plan()
+        state = [0] * len(self.order)
+        counts = {q: [0.0] * len(self.nodes[q].values) for q in query}
+        query_ids = [(self.index[q], counts[q]) for q in query]
+        total = total_2 = 0.0  # sums of weights and squared weights
+        for s in range(steps):
+            weight = 1.0
+            for i, table, n_values, parents in plan:
+                offset = 0
+                for p, stride in parents:
+                    offset += state[p] * stride
+                if i in evidence:
+                    state[i] = evidence[i]
+                    weight *= table[offset + state[i]]
+                else:
+                    state[i] = draw(table, offset, n_values, rng)
+            for i, count in query_ids:
+                count[state[i]] += weight
+            total += weight
+            total_2 += weight * weight
+            if precision and (s + 1) % check_every == 0 and total:
+                n = total * total / total_2  # effective sample size
+                if (n >= check_every
+                        and max_standard_error(counts, n) < precision):
+                    break
+        if not total:
+            raise ZeroDivisionError('all ' + str(steps) + ' samples have'
+                                    + ' zero weight, evidence has zero'
+                                    + ' probability')
+        return self._counters(counts)
+
+    def rejection_sampling(self, ev={}, query=[], steps=1000,
+                           precision=None, check_every=100, rng=None):
+        """Returns probability estimates for each query, based on
+        provided evidence, from samples of the joint distribution drawn
+        in topological order, rejecting those contradicting evidence.
+        Suitable for evidence of high probability. When precision is
+        given, sampling stops as soon as standard errors of all the
+        estimates, checked every check_every samples, fall below it,
+        provided at least check_every samples have been accepted.
+        Raises ZeroDivisionError if no sample has been accepted."""
+        rng = make_rng(rng)
+        evidence = {self.index[n]: self.nodes[n].value_index[v]
+                    for n, v in ev.items()}
+        plan = self._sampling_plan()
+        state = [0] * len(self.order)
+        counts = {q: [0.0] * len(self.nodes[q].values) for q in query}
+        query_ids = [(self.index[q], counts[q]) for q in query]
+        accepted = 0
+        for s in range(steps):
+            for i, table, n_values, parents in plan:
+                offset = 0
+                for p, stride in parents:
+                    offset += state[p] * stride
+                state[i] = draw(table, offset, n_values, rng)
+                if i in evidence and state[i] != evidence[i]:
+                    break
+            else:
+                for i, count in query_ids:
+                    count[state[i]] += 1
+                accepted += 1
+            if (precision and (s + 1) % check_every == 0
+                    and accepted >= check_every
+                    and max_standard_error(counts, accepted) < precision):
+                break
+        if not accepted:
+            raise ZeroDivisionError('none of ' + str(steps) + ' samples'
+                                    + ' agrees with evidence, use more'
+                                    + ' steps or likelihood_weighting')
+        return self._counters(counts)
+
+    def _sampling_plan(self):
+        """Returns tuples of node's index, compiled table, number of
+        values and (index, stride) pairs of parents, for all the nodes
+        in topological order."""
+        plan = []
+        for name in self.topological_order():
+            node = self.nodes[name]
+            parents = [(self.index[p], s) for p, s in zip(node.parents,
+                                                          node.strides)]
+            plan.append((self.index[name], node.table, len(node.values),
+                         parents))
+        return plan
+
+    def sample(self, n, chunk_size=SAMPLES_CHUNK, rng=None):
+        """Yields n samples of the joint distribution, drawn in
+        topological order, in chunks of at most chunk_size samples.
+        A chunk is a list of columns, one per node in self.order, of
+        indices of the nodes' values. Each column is drawn at once,
+        from cumulative distributions of the rows selected by parents'
+        columns."""
+        rng = make_rng(rng)
+        plan = []
+        for i, table, n_values, parents in self._sampling_plan():
+            cumulative = []
+            for offset in range(0, len(table), n_values):
+                total = 0.0
+                row = []
+                for v in range(offset, offset + n_values - 1):
+                    total += table[v]
+                    row.append(total)
+                cumulative.append(row)
+            plan.append((i, cumulative,
+                         [(p, stride // n_values) for p, stride in parents]))
+        for start in range(0, n, chunk_size):
+            size = min(chunk_size, n - start)
+            columns = [None] * len(self.order)
+            for i, cumulative, parents in plan:
+                uniforms = rng_batch(rng, size)
+                if not parents:
+                    row = cumulative[0]
+                    columns[i] = [bisect_right(row, u) for u in uniforms]
+                    continue
+                p, stride = parents[0]
+                rows = [v * stride for v in columns[p]]
+                for p, stride in parents[1:]:
+                    rows = [r + v * stride for r, v in zip(rows, columns[p])]
+                columns[i] = [bisect_right(cumulative[r], u)
+                              for r, u in zip(rows, uniforms)]
+            yield columns
+
+    def log_likelihood(self, batch):
+        """Returns list of natural logarithms of joint probabilities of
+        complete assignments in batch, -inf for impossible ones. Batch
+        holds columns of indices of values, either a list of them
+        ordered as self.order or a mapping, like a pandas DataFrame,
+        from names of nodes to them; rows of such indices are turned
+        into columns with zip(*rows). Every node's column is scored
+        at once, with a lookup of its offsets in the node's table of
+        logarithms. Raises ValueError if batch does not hold a column
+        of valid indices for every node, all of the same length."""
+        if hasattr(batch, 'keys'):
+            batch = [batch[name] for name in self.order]
+        if len(batch) != len(self.order):
+            raise ValueError('Expected ' + str(len(self.order))
+                             + ' columns, one per node, got '
+                             + str(len(batch)) + '.')
+        n_rows = len(batch[0]) if batch else 0
+        for name, column in zip(self.order, batch):
+            if len(column) != n_rows:
+                raise ValueError('Column \"' + name + '\" has '
+                                 + str(len(column)) + ' rows instead of '
+                                 + str(n_rows) + '.')
+            if n_rows and (min(column) < 0 or max(column)
+                           >= len(self.nodes[name].values)):
+                raise ValueError('Column \"' + name + '\" holds indices'
+                                 + ' of values out of range.')
+        if self.log_tables is None:
+            self.log_tables = []
+            for name in self.order:
+                node = self.nodes[name]
+                table = [math.log(p) if p > 0 else -math.inf
+                         for p in node.table]
+                parents = [(self.index[p], s) for p, s in zip(node.parents,
+                                                              node.strides)]
+                self.log_tables.append((self.index[name], table, parents))
+        totals = None
+        for i, table, parents in self.log_tables:
+            offsets = batch[i]
+            for p, stride in parents:
+                offsets = [o + v * stride for o, v in zip(offsets, batch[p])]
+            if totals is None:
+                totals = [table[o] for o in offsets]
+            else:
+                totals = [t + table[o] for t, o in zip(totals, offsets)]
+        return totals or []
+
+    def _counters(self, counts):
+        """Returns normalized counters from counts of value indices."""
+        counters = {}
+        for q, count in counts.items():
+            counters[q] = dict(zip(self.nodes[q].values, map(float, count)))
+        return normalize(counters)
+
+    def query_exact(self, ev={}, query=[], heuristic='min_fill',
+                    prune=False):
+        """Returns exact probabilities for each query, based on provided
+        evidence, computed by variable elimination. Variables are
+        eliminated in order chosen with the given heuristic, min_fill
+        or min_degree. Factors produced by elimination steps are cached,
+        so queries sharing evidence reuse them. When prune is True,
+        only nodes relevant to the query are considered."""
+        if prune:
+            bayes_net = self.prune(ev, query)
+            return bayes_net.query_exact({n: v for n, v in ev.items()
+                                          if n in bayes_net.nodes}, query,
+                                         heuristic)
+        evidence = {n: self.nodes[n].value_index[v] for n, v in ev.items()}
+        factors = [self._cpt_factor(n, evidence) for n in self.order]
         counters = {}
-        values_of_interest = lambda q: [v for v in self.nodes[q].values]
         for q in query:
-            counters[q] = dict.fromkeys(values_of_interest(q), 0.0)
-        # Random walking:
-        for s in range(steps):
-            x = choice(unknown)  # Draw a node not belonging to evidence
-            evidence[x] = self.mb_sampling(x, evidence)
-            for q in query:
-                counters[q][evidence[q]] += 1
-        # Normalize counters to get a probability distribution:
-        s = dict.fromkeys(counters.keys(), 0.0)
-        for c, v in counters.items():
-            for p in v.values():
-                s[c] += p
-        for c, v in counters.items():
-            for k in v.keys():
-                counters[c][k] /= s[c]
-        return counters
+            values = self.nodes[q].values
+            if q in evidence:
+                counters[q] = {v: float(v == ev[q]) for v in values}
+                continue
+            counters[q] = dict(zip(values,
+                                   self._eliminate(factors, q, heuristic)))
+        return normalize(counters)
+
+    def query_junction_tree(self, ev={}, query=[]):
+        """Returns exact probabilities for each query, based on provided
+        evidence, using the junction tree of the network. The tree is
+        compiled on the first call and kept on the network; subsequent
+        calls recompute only messages affected by changed evidence."""
+        if self.junction_tree is None:
+            self.junction_tree = JunctionTree(self)
+        evidence = {n: self.nodes[n].value_index[v] for n, v in ev.items()}
+        self.junction_tree.set_evidence(evidence)
+        counters = {}
+        for q in query:
+            counters[q] = dict(zip(self.nodes[q].values,
+                                   self.junction_tree.marginal(q)))
+        return normalize(counters)
+
+    def _cpt_factor(self, name, evidence):
+        """Returns factor of the node's conditional probability table,
+        reduced by evidence given as value indices."""
+        node = self.nodes[name]
+        variables = list(node.parents) + [name]
+        key = ('cpt', name, tuple((v, evidence[v]) for v in variables
+                                  if v in evidence))
+        factor = Factor(variables,
+                        [len(self.nodes[v].values) for v in variables],
+                        node.table, key)
+        return factor.reduce(evidence)
+
+    def _eliminate(self, factors, q, heuristic):
+        """Returns unnormalized distribution of q obtained by summing
+        all the other variables out of the product of factors."""
+        for v in elimination_order(factors, [q], heuristic):
+            related = [f for f in factors if v in f.variables]
+            key = ('sum', v, frozenset(f.key for f in related))
+            factor = self.factor_cache.get(key)
+            if factor is None:
+                factor = related[0]
+                for f in related[1:]:
+                    factor = factor.multiply(f)
+                factor = factor.sum_out(v)
+                factor.key = key
+                self.factor_cache[key] = factor
+                if len(self.factor_cache) > self.factor_cache_size:
+                    self.factor_cache.popitem(last=False)
+            else:
+                self.factor_cache.move_to_end(key)
+            factors = [f for f in factors if v not in f.variables]
+            factors.append(factor)
+        result = factors[0]
+        for f in factors[1:]:
+            result = result.multiply(f)
+        return result.values
+
+    def prune(self, ev, query):
+        """Returns network of the nodes relevant to the query given
+        evidence on the ev nodes: barren nodes, outside the ancestors of
+        query and evidence, are removed, and so are nodes d-separated
+        from the query by evidence. Evidence nodes kept only to provide
+        values for their children, with none of their parents relevant,
+        become roots. Pruned networks are cached per sets of evidence
+        and query nodes."""
+        key = (frozenset(ev), frozenset(query))
+        if key in self.pruned:
+            return self.pruned[key]
+        # Ancestral set of query and evidence nodes:
+        ancestral = set(query) | set(ev)
+        stack = list(ancestral)
+        while stack:
+            for parent in self.nodes[stack.pop()].parents:
+                if parent not in ancestral:
+                    ancestral.add(parent)
+                    stack.append(parent)
+        # Moral graph of the ancestral set:
+        neighbours = {n: set() for n in ancestral}
+        for n in ancestral:
+            family = list(self.nodes[n].parents) + [n]
+            for a in family:
+                neighbours[a].update(f for f in family if f != a)
+        # Nodes connected with the query by paths avoiding evidence,
+        # and evidence nodes adjacent to them:
+        relevant = set(query)
+        stack = [q for q in query if q not in ev]
+        while stack:
+            for n in neighbours[stack.pop()]:
+                if n not in relevant:
+                    relevant.add(n)
+                    if n not in ev:
+                        stack.append(n)
+        bayes_net = BayesNet()
+        for n in self.order:
+            if n not in relevant:
+                continue
+            node = self.nodes[n]
+            if n in ev and not any(p in relevant and p not in ev
+                                   for p in node.parents):
+                # Node's probability does not depend on relevant nodes:
+                node = Node(parents=[], values=node.values,
+                            probabilities=[ConditionalProbability(
+                                '', v, 1.0 / len(node.values))
+                                for v in node.values])
+                node.compile([])
+            bayes_net.nodes[n] = node
+        bayes_net._connect()
+        bayes_net.compile(tables=False)
+        if len(self.pruned) >= self.pruned_size:
+            self.pruned.pop(next(iter(self.pruned)))
+        self.pruned[key] = bayes_net
+        return bayes_net
 
     def markov_blanket(self, node):
-        """Returns Markov blanket for a given node."""
-        res = []
-        # list of all nodes but node from the list them:
-        all_but_me = lambda them: [n for n in them if n != node]
-        # list of all nodes from the list them that are not in res yet:
-        unique = lambda them: [n for n in them if n not in res]
-        for parent in self.nodes[node].parents:  # for all node's parents
-            res.append(parent)  # add the parent to res
-        for child in self.edges[node]:  # for all node's children
-            res.append(child)   # add the child to res
-            # append res with the child's other parents not added yet:
-            res += unique(all_but_me(self.nodes[child].parents))
-        return res
+        """Returns Markov blanket for a given node: its parents, its
+        children and their other parents. Blankets are computed once
+        and cached until the graph is connected anew."""
+        if node not in self.blankets:
+            res = list(self.nodes[node].parents)
+            seen = set(res)
+            seen.add(node)
+            for child in self.edges[node]:  # for all node's children
+                for n in [child] + list(self.nodes[child].parents):
+                    if n not in seen:
+                        seen.add(n)
+                        res.append(n)
+            self.blankets[node] = res
+        return list(self.blankets[node])
 
-    def mb_sampling(self, node, evidence):
+    def markov_blankets(self):
+        """Returns Markov blankets of all the nodes."""
+        return {n: self.markov_blanket(n) for n in self.nodes}
+
+    def mb_sampling(self, node, evidence, cache=None, rng=random):
         """Returns probability sampled with conditioning on Markov
-        blanket."""
+        blanket. When a MarkovBlanketCache is given, distributions are
+        looked up in it instead of being recomputed."""
+        if cache is None:
+            values, totals = self.mb_distribution(node, evidence)
+        else:
+            values, totals = cache.get(node, evidence)
+        random_value = rng.random()
+        i = bisect_left(totals, random_value)
+        return values[min(i, len(values) - 1)]
+
+    def mb_distribution(self, node, evidence):
+        """Returns node's values, in alphabetical order, and their
+        cumulative probabilities conditioned on Markov blanket."""
         values = quicksort(self.nodes[node].values)
-        probabilities = dict.fromkeys(values)
-        for value in values:
-            probabilities[value] = self.p_value(node, evidence, value)
+        probabilities = [self.p_value(node, evidence, v) for v in values]
         s = 0.0
-        for value in values:
-            s += probabilities[value]
-        for value in values:
-            probabilities[value] /= s
-        random_value = random.random()
+        for p in probabilities:
+            s += p
+        totals = []
         total = 0.0
-        for value, probability in probabilities.items():
-            total += probability
-            if random_value <= total:
-                return value
+        for p in probabilities:
+            total += p / s
+            totals.append(total)
+        return values, totals
 
     def p_value(self, node, ev, value):
         """Returns probability for node to take given value."""
@@ -119,33 +892,85 @@ class BayesNet:
         """Returns conditional probability of node taking its value
         from the evidence list, under condition of parents taking
         values from that list."""
-        p_x_c_parents = 0.0  # P(X=x_j|Parents(X))
-        e_parents = ''  # evidence for node's parents
-        for i, p in enumerate(self.nodes[node].parents):
-            if i:
-                e_parents += ','
-            #print('    ', evidence[p])
-            e_parents += evidence[p]
-        c1 = lambda p: p.parents == e_parents
-        c2 = lambda p: p.child == value
-        for p in self.nodes[node].probabilities:
-            if c1(p) and c2(p):
-                p_x_c_parents = p.probability
-                #print(node, value, p.probability)
-        return p_x_c_parents
-
-    def validate(self):
+        n = self.nodes[node]
+        offset = n.value_index.get(value)  # P(X=x_j|Parents(X)) index
+        if offset is None:
+            return 0.0
+        for p, index, stride in zip(n.parents, n.parent_index, n.strides):
+            i = index.get(evidence[p])
+            if i is None:
+                return 0.0
+            offset += i * stride
+        return n.table[offset]
+
+    def compile(self, tables=True):
+        """Builds dense conditional probability tables of all nodes and
+        assigns every node an integer index. Tables are left as they
+        are if tables is False."""
+        self.order = list(self.nodes.keys())
+        self.index = {n: i for i, n in enumerate(self.order)}
+        self.factor_cache.clear()
+        self.junction_tree = None
+        self.digest = None
+        self.log_tables = None
+        if not tables:
+            return
+        for node in self.nodes.values():
+            node.compile([self.nodes[p] for p in node.parents])
+
+    def fingerprint(self):
+        """Returns sha256 digest of the network's structure and
+        conditional probability tables, computed once per compilation."""
+        if self.digest is None:
+            content = [(n, list(self.nodes[n].values),
+                        list(self.nodes[n].parents),
+                        list(self.nodes[n].table)) for n in self.order]
+            self.digest = hashlib.sha256(
+                json.dumps(content).encode('utf-8')).hexdigest()
+        return self.digest
+
+    def compact(self):
+        """Switches all the compiled nodes to compact storage."""
+        for node in self.nodes.values():
+            node.compact()
+
+    def _factors(self, i):
+        """Returns compiled tables the node of index i takes part in:
+        its own and its children's. Each one is described by a tuple of
+        the table, the stride of the node's value in that table and
+        a list of (index, stride) pairs of the remaining variables."""
+        name = self.order[i]
+        factors = []
+        for f in [name] + self.edges[name]:
+            node = self.nodes[f]
+            variables = [(self.index[p], s) for p, s in zip(node.parents,
+                                                            node.strides)]
+            variables.append((self.index[f], 1))
+            coefficient = sum(s for j, s in variables if j == i)
+            others = [(j, s) for j, s in variables if j != i]
+            factors.append((node.table, coefficient, others))
+        return factors
+
+    def validate(self, nodes=True):
+        """Evaluates to True if the network has nodes, all the parents
+        are defined and the graph contains no cycles. Nodes themselves
+        are validated unless nodes is False."""
         msg = ''
         if not self.nodes:
             msg += 'No nodes initialized.'
             return False, msg
         for node in self.nodes.items():
-            valid, err_msg = node[1].validate()
+            valid, err_msg = node[1].validate() if nodes else (True, '')
             if not valid:
                 self.nodes = {}
                 msg += 'Node \"' + node[0] + '\" invalid.'
                 msg += err_msg
                 return False, msg
+            for parent in node[1].parents:
+                if parent not in self.nodes:
+                    msg += ('Parent \"' + parent + '\" of node \"' + node[0]
+                            + '\" not found.')
+                    return False, msg
         if self.check_cycles():
             msg += 'Cycles found in graph.'
             return False, msg
@@ -154,35 +979,34 @@ class BayesNet:
     def check_cycles(self):
         """Evaluates to True if the bayesian network graph
         contains cycles, otherwise evaluates to False."""
-        visited = []
-        r_stack = []
-
-        def neighbour_cycle(vertex):    # inner function of check_cycles
-            """Evaluates to True if any visited neighbour
-            is in recursion stack, otherwise evaluates to False."""
-            visited.append(vertex)
-            r_stack.append(vertex)
-
-            for neighbour in self.edges[vertex]:
-                if neighbour not in visited and neighbour_cycle(neighbour):
-                    return True
-                elif neighbour in r_stack:
-                    return True
-
-            r_stack.remove(vertex)
-            return False
+        return len(self.topological_order()) != len(self.nodes)
 
-        for node in self.nodes.keys():
-            if node not in visited and neighbour_cycle(node):
-                return True
-        return False
+    def topological_order(self):
+        """Returns names of nodes ordered so that parents precede their
+        children, computed with Kahn's algorithm. Nodes lying on cycles,
+        or descending from them, are left out. The order is cached until
+        the graph is connected anew."""
+        if self.topological is not None:
+            return self.topological
+        in_degree = {n: len(self.nodes[n].parents) for n in self.nodes}
+        order = [n for n, d in in_degree.items() if not d]
+        for node in order:
+            for child in self.edges[node]:
+                in_degree[child] -= 1
+                if not in_degree[child]:
+                    order.append(child)
+        self.topological = order
+        return order
 
-    def random(self, node):
+    def random(self, node, rng=random):
         """Returns value drawn from node's values."""
-        return self.nodes[node].random()
+        return self.nodes[node].random(rng)
 
     def _connect(self):
         """Updates edges dictionary."""
+        self.topological = None
+        self.blankets = {}
+        self.pruned = {}
         for node in self.nodes.items():
             for parent in node[1].parents:
                 self.edges[parent].append(node[0])
@@ -199,19 +1023,16 @@ class BayesNet:
         if not check_json(data, REQUIRED_KEYS):
             return nodes
         for node_name in data[NODES]:
-            parents_table = data[RELATIONS][node_name][PARENTS]
-            probability_table = data[RELATIONS][node_name][PROBABILITIES]
+            relation = data[RELATIONS][node_name]
             probabilities = []
-            values = []
-            for item in probability_table.items():
-                parents, child = split_key(item[0])
-                probability = item[1]
+            values = {}  # Node's values, in order of appearance
+            for key, probability in relation[PROBABILITIES].items():
+                parents, child = split_key(key)
                 probabilities.append(ConditionalProbability(parents, child,
                                                             probability))
-                if child not in values:
-                    values.append(child)
-            node = Node(parents=parents_table, probabilities=probabilities,
-                        values=values)
+                values[child] = None
+            node = Node(parents=relation[PARENTS],
+                        probabilities=probabilities, values=list(values))
             node.sort()
             valid, err_msg = node.validate()
             if not valid:
@@ -223,6 +1044,20 @@ class BayesNet:
         return nodes
 
 
+_worker_bayes_net = None  # BayesNet of the current worker process
+
+
+def _init_worker(bayes_net):
+    """Stores the network in a worker process of parallel_mcmc."""
+    global _worker_bayes_net
+    _worker_bayes_net = bayes_net
+
+
+def _run_chain(ev, query, steps, seed):
+    """Runs a single seeded chain in a worker process of parallel_mcmc."""
+    return _worker_bayes_net.mcmc(ev, query, steps, rng=seed)
+
+
 def main(args):
     steps = int(args[2]) if len(args) == 3 else 1000
     bayes_net = BayesNet()
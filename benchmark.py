@@ -0,0 +1,191 @@
+"""Benchmarks of the bayesian network implementation, run on randomly
+generated networks of increasing size."""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from itertools import product
+
+from bayes_net import BayesNet
+from constants import NODES, RELATIONS, PARENTS, PROBABILITIES
+
+
+TOPOLOGIES = ['chain', 'tree', 'polytree', 'dag']
+
+
+def generate_network(n_nodes, max_parents=2, n_values=2, seed=0,
+                     topology='dag'):
+    """Returns a random network in the json format, with n_values values
+    per node. Parents are drawn from preceding nodes, according to
+    the topology:
+        chain    - every node but the first has the preceding one;
+        tree     - every node but the first has a single parent;
+        polytree - up to max_parents parents, no undirected cycles;
+        dag      - up to max_parents parents."""
+    rng = random.Random(seed)
+    names = ['n' + str(i) for i in range(n_nodes)]
+    values = ['v' + str(i) for i in range(n_values)]
+    component = list(range(n_nodes))  # for joining polytree's trees
+
+    def find(i):
+        while component[i] != i:
+            component[i] = component[component[i]]
+            i = component[i]
+        return i
+
+    relations = {}
+    for i, name in enumerate(names):
+        if topology == 'chain':
+            parents = names[i - 1:i]
+        elif topology == 'tree':
+            parents = [rng.choice(names[:i])] if i else []
+        elif topology == 'polytree':
+            parents = []
+            for j in rng.sample(range(i), min(i, rng.randint(0,
+                                                             max_parents))):
+                if find(j) != find(i):
+                    component[find(j)] = find(i)
+                    parents.append(names[j])
+        else:
+            parents = rng.sample(names[:i],
+                                 min(i, rng.randint(0, max_parents)))
+        probabilities = {}
+        for assignment in product(values, repeat=len(parents)):
+            weights = [rng.random() + 0.01 for _ in values]
+            total = sum(weights)
+            for value, weight in zip(values, weights):
+                key = ','.join(assignment + (value,))
+                probabilities[key] = weight / total
+        relations[name] = {PARENTS: parents, PROBABILITIES: probabilities}
+    return {NODES: names, RELATIONS: relations}
+
+
+def write_network(network, directory, name='network'):
+    """Writes the network into a json file in directory, returns its
+    name."""
+    filename = os.path.join(directory, name + '_' + str(len(network[NODES]))
+                            + '.json')
+    with open(filename, 'w') as file:
+        json.dump(network, file)
+    return filename
+
+
+def bench_load(sizes, max_parents=4, n_values=2, repeat=3):
+    """Returns the best of repeat load times, in seconds, of networks of
+    given sizes."""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            filename = write_network(
+                generate_network(size, max_parents, n_values), directory)
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                BayesNet().load(filename)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[size] = best
+    return results
+
+
+def timed(function, *args, **kwargs):
+    """Returns result of the call of function and its duration in
+    seconds."""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_network(filename, steps=10000, exact=True):
+    """Returns timings of loading the network from the file, validating
+    it, computing all Markov blankets and sampling, along with the
+    largest error of mcmc estimates of the last node's distribution,
+    given the first node's first value, versus exact answers."""
+    bayes_net = BayesNet()
+    _, load = timed(bayes_net.load, filename)
+    bayes_net.topological = None
+    _, validation = timed(bayes_net.validate)
+    bayes_net.blankets = {}
+    _, blankets = timed(bayes_net.markov_blankets)
+    first, last = bayes_net.order[0], bayes_net.order[-1]
+    ev = {first: bayes_net.nodes[first].values[0]}
+    answer, sampling = timed(bayes_net.mcmc, ev, [last], steps)
+    result = {
+        'nodes': len(bayes_net.nodes),
+        'load_time': load,
+        'validation_time': validation,
+        'markov_blanket_time': blankets,
+        'mcmc_steps_per_second': steps / sampling,
+        'mcmc_error': None,
+    }
+    if exact:
+        truth = bayes_net.query_exact(ev, [last])[last]
+        result['mcmc_error'] = max(abs(answer[last][v] - p)
+                                   for v, p in truth.items())
+    return result
+
+
+def bench_suite(sizes, topologies=TOPOLOGIES, max_parents=3, n_values=2,
+                steps=10000, exact_limit=30, seed=0):
+    """Returns results of bench_network for generated networks of every
+    topology and size. Exact answers are computed for all chains, trees
+    and polytrees, and for dags of up to exact_limit nodes."""
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for topology in topologies:
+            for size in sizes:
+                network = generate_network(size, max_parents, n_values,
+                                           seed, topology)
+                filename = write_network(network, directory, topology)
+                exact = topology != 'dag' or size <= exact_limit
+                result = bench_network(filename, steps, exact)
+                result.update(topology=topology, max_parents=max_parents,
+                              n_values=n_values, steps=steps)
+                results.append(result)
+    return results
+
+
+def parse_arguments(args):
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("-n", "--sizes", type=int, nargs='+',
+                    default=[10, 100, 1000], help='numbers of nodes')
+    ap.add_argument("-t", "--topologies", nargs='+', default=TOPOLOGIES,
+                    choices=TOPOLOGIES)
+    ap.add_argument("-p", "--max-parents", type=int, default=3)
+    ap.add_argument("-v", "--values", type=int, default=2,
+                    help='number of values of every node')
+    ap.add_argument("-s", "--steps", type=int, default=10000)
+    ap.add_argument("-x", "--exact-limit", type=int, default=30,
+                    help='largest dag compared with exact answers')
+    ap.add_argument("-o", "--output", help='json file for results')
+    ap.add_argument("--load-only", action='store_true',
+                    help='only report load time versus network size')
+    return ap.parse_args(args)
+
+
+def main(args):
+    args = parse_arguments(args)
+    if args.load_only:
+        print('Load time versus network size:')
+        for size, elapsed in bench_load(args.sizes, args.max_parents,
+                                        args.values).items():
+            print('{:>8} nodes: {:.4f} s'.format(size, elapsed))
+        return
+    results = bench_suite(args.sizes, args.topologies, args.max_parents,
+                          args.values, args.steps, args.exact_limit)
+    for r in results:
+        print('{topology:>8} {nodes:>6} nodes: load {load_time:.4f} s, '
+              'validation {validation_time:.4f} s, blankets '
+              '{markov_blanket_time:.4f} s, {mcmc_steps_per_second:.0f} '
+              'steps/s, error {mcmc_error}'.format(**r))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1:])
@@ -0,0 +1,75 @@
+import math
+
+from constants import CHAIN_BATCHES
+from utils import normalize
+
+
+class Chain:
+    """Used for storing the state of a Markov chain run by
+    BayesNet.mcmc_iter: value indices of all the nodes and counts of
+    values of queried nodes, kept per batch of consecutive steps for
+    the method of batch means. A chain can be kept, or pickled, and
+    passed back to mcmc_iter to resume sampling where it stopped."""
+
+    def __init__(self, state, unknown, query, values):
+        self.state = state      # current value indices of all the nodes
+        self.unknown = unknown  # indices of nodes sampled by the chain
+        self.query = query
+        self.values = values    # values of queried nodes
+        # counts of value indices of queried nodes in complete batches:
+        self.counts = {q: [0] * len(values[q]) for q in query}
+        self.batches = []       # counts of every complete batch
+        self.batch = self._empty()  # counts of the current batch
+        self.batch_size = 1     # steps per batch
+        self.filled = 0         # steps counted in the current batch
+        self.steps = 0          # number of counted steps
+
+    def _empty(self):
+        return {q: [0] * len(self.values[q]) for q in self.query}
+
+    def add(self, steps):
+        """Accounts for steps counted in the current batch, which are
+        at most enough to complete it. When CHAIN_BATCHES batches are
+        complete, pairs of them are merged into batches twice as long."""
+        self.steps += steps
+        self.filled += steps
+        if self.filled < self.batch_size:
+            return
+        for q, count in self.batch.items():
+            total = self.counts[q]
+            for v, c in enumerate(count):
+                total[v] += c
+        self.batches.append(self.batch)
+        self.batch = self._empty()
+        self.filled = 0
+        if len(self.batches) == CHAIN_BATCHES:
+            self.batches = [{q: [a + b for a, b in zip(x[q], y[q])]
+                             for q in self.query}
+                            for x, y in zip(self.batches[::2],
+                                            self.batches[1::2])]
+            self.batch_size *= 2
+
+    def estimates(self):
+        """Returns probability estimates for each query."""
+        return normalize({q: dict(zip(self.values[q],
+                                      [float(c + b) for c, b in
+                                       zip(count, self.batch[q])]))
+                          for q, count in self.counts.items()})
+
+    def errors(self):
+        """Returns standard errors of the estimates, computed with the
+        method of batch means, so that correlation of consecutive steps
+        is accounted for; infinite until two batches are complete."""
+        n = len(self.batches)
+        errors = {}
+        for q in self.query:
+            errors[q] = {}
+            for v, value in enumerate(self.values[q]):
+                if n < 2:
+                    errors[q][value] = math.inf
+                    continue
+                x = [b[q][v] / self.batch_size for b in self.batches]
+                mean = sum(x) / n
+                variance = sum((a - mean) ** 2 for a in x) / (n - 1)
+                errors[q][value] = math.sqrt(variance / n)
+        return errors
@@ -0,0 +1,165 @@
+"""Binary format of compiled bayesian networks.
+
+A file consists of a header, a json encoded list of nodes' names and
+values, an index section of 64-bit integers holding, for every node,
+the number of its parents, their indices, the number of its rows and
+their offsets in the table, and a section of 64-bit floats holding
+dense tables of all the nodes. Sections are aligned to 8 bytes, so that
+they can be used directly from a memory-mapped file."""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+
+from node import Node
+
+MAGIC = b'BNET'
+VERSION = 1
+# magic, version, byte order, source mtime, source hash, lengths of
+# names, index and table sections:
+HEADER = struct.Struct('<4sIcq32sQQQ')
+
+
+def source_stamp(source):
+    """Returns modification time, in nanoseconds, and sha256 digest of
+    the source file, (0, zeros) if no source is given."""
+    if not source:
+        return 0, bytes(32)
+    with open(source, 'rb') as file:
+        digest = hashlib.sha256(file.read()).digest()
+    return os.stat(source).st_mtime_ns, digest
+
+
+def save_compiled(bayes_net, path, source=None):
+    """Writes the compiled network into a binary file. The file is
+    written under a temporary name in the same directory, then renamed
+    to path, so that processes mapping path never see it incomplete."""
+    names = []
+    index = []
+    tables = []
+    for name in bayes_net.order:
+        node = bayes_net.nodes[name]
+        names.append([name, list(node.values)])
+        if node.rows is None:
+            rows = [node._offset(p) for p in node.probabilities]
+            rows = [r for r in rows if r is not None]
+        else:
+            rows = list(node.rows)
+        index += [len(node.parents)]
+        index += [bayes_net.index[p] for p in node.parents]
+        index += [len(rows)] + rows
+        tables += list(node.table)
+    names = json.dumps(names).encode('utf-8')
+    mtime, digest = source_stamp(source)
+    temporary = path + '.' + str(os.getpid()) + '.' + os.urandom(4).hex()
+    try:
+        with open(temporary, 'xb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION,
+                                   sys.byteorder[0].encode(), mtime, digest,
+                                   len(names), len(index), len(tables)))
+            file.write(bytes(-HEADER.size % 8))
+            file.write(names + bytes(-len(names) % 8))
+            file.write(struct.pack('=' + str(len(index)) + 'q', *index))
+            file.write(struct.pack('=' + str(len(tables)) + 'd', *tables))
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def load_compiled(bayes_net, path, source=None):
+    """Loads the compiled network from a memory-mapped binary file;
+    tables and rows of nodes are views of the mapped file. Evaluates to
+    False, leaving the network unchanged, if the file is missing,
+    truncated or malformed, of another version or byte order, or if the
+    source file given has changed since the network was saved."""
+    if not os.path.isfile(path) or os.stat(path).st_size < HEADER.size:
+        return False
+    with open(path, 'rb') as file:
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    nodes = _read_nodes(mapping, source)
+    if nodes is None:
+        mapping.close()
+        return False
+    bayes_net.nodes = nodes
+    bayes_net.mapping = mapping
+    return True
+
+
+def _read_nodes(mapping, source):
+    """Returns nodes read from the mapped file, None if it cannot be
+    used. Views of the mapping are released before returning None."""
+    header = HEADER.unpack_from(mapping)
+    magic, version, byteorder, mtime, digest, n_names, n_index, n_table \
+        = header
+    if (magic != MAGIC or version != VERSION
+            or byteorder != sys.byteorder[0].encode()):
+        return None
+    if source:
+        if not os.path.isfile(source):
+            return None
+        if mtime != os.stat(source).st_mtime_ns \
+                and digest != source_stamp(source)[1]:
+            return None
+    start = HEADER.size + (-HEADER.size % 8)
+    if (start + n_names + (-n_names % 8) + 8 * (n_index + n_table)
+            != len(mapping)):
+        return None
+    try:
+        names = json.loads(bytes(mapping[start:start + n_names]))
+    except ValueError:
+        return None
+    start += n_names + (-n_names % 8)
+    with memoryview(mapping) as view:
+        index = view[start:start + 8 * n_index].cast('q')
+        start += 8 * n_index
+        table = view[start:start + 8 * n_table].cast('d')
+        try:
+            nodes = _layout_nodes(names, index, table)
+        except (ValueError, TypeError, IndexError, KeyError):
+            nodes = None
+        if nodes is None:
+            index.release()
+            table.release()
+        return nodes
+
+
+def _layout_nodes(names, index, table):
+    """Returns nodes whose parents and rows are read from the index and
+    tables are views of the table, None unless the index and the table
+    are of the sizes the nodes require."""
+    nodes = {}
+    order = [name for name, _ in names]
+    parents = []
+    rows = []
+    i = 0
+    for name, values in names:
+        n_parents = index[i]
+        if n_parents < 0 or any(p < 0 for p in
+                                index[i + 1:i + 1 + n_parents]):
+            return None
+        parents.append([order[p] for p in index[i + 1:i + 1 + n_parents]])
+        i += 1 + n_parents
+        n_rows = index[i]
+        rows.append(index[i + 1:i + 1 + n_rows])
+        i += 1 + n_rows
+        nodes[name] = Node(parents=tuple(sys.intern(p) for p in parents[-1]),
+                           probabilities=None,
+                           values=tuple(sys.intern(v) for v in values))
+    if i != len(index):
+        return None
+    sizes = [node.layout([nodes[p] for p in node.parents])
+             for node in nodes.values()]
+    if sum(sizes) != len(table):
+        return None
+    offset = 0
+    for node, node_rows, size in zip(nodes.values(), rows, sizes):
+        if any(r < 0 or r >= size for r in node_rows):
+            return None
+        node.table = table[offset:offset + size]
+        node.rows = node_rows
+        offset += size
+    return nodes
@@ -9,3 +9,11 @@ PROBABILITIES = 'probabilities'
 REQUIRED_KEYS = [NODES, RELATIONS]
 
 INDENT = '  '
+
+TOLERANCE = 1e-9  # allowed deviation of total probability from 1.0
+
+UNIFORMS_BATCH = 4096  # steps of a sampler per batch of uniform numbers
+
+SAMPLES_CHUNK = 65536  # samples of the joint distribution per chunk
+
+CHAIN_BATCHES = 64  # most batches of steps a chain keeps for batch means
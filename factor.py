@@ -0,0 +1,113 @@
+from itertools import product
+
+
+class Factor:
+    """Used for storing a function of a number of discrete variables,
+    as a flat list of values indexed with mixed-radix strides (the last
+    variable changing fastest)."""
+
+    def __init__(self, variables, cardinalities, values, key=None):
+        self.variables = list(variables)  # names of factor's variables
+        self.cardinalities = list(cardinalities)  # numbers of values
+        self.values = values
+        self.key = key  # hashable description of how factor was built
+        self.strides = []
+        stride = 1
+        for c in reversed(self.cardinalities):
+            self.strides.insert(0, stride)
+            stride *= c
+
+    def __len__(self):
+        return len(self.values)
+
+    def stride(self, variable):
+        """Returns stride of the variable, 0 if it is not in the factor."""
+        if variable in self.variables:
+            return self.strides[self.variables.index(variable)]
+        return 0
+
+    def reduce(self, evidence):
+        """Returns factor with variables from the evidence fixed to
+        their values, given as value indices."""
+        fixed = [v for v in self.variables if v in evidence]
+        if not fixed:
+            return self
+        offset = sum(self.stride(v) * evidence[v] for v in fixed)
+        free = [(v, c, s) for v, c, s in zip(self.variables,
+                                             self.cardinalities,
+                                             self.strides)
+                if v not in evidence]
+        values = []
+        for assignment in product(*[range(c) for _, c, _ in free]):
+            i = offset
+            for a, (_, _, s) in zip(assignment, free):
+                i += a * s
+            values.append(self.values[i])
+        return Factor([v for v, _, _ in free], [c for _, c, _ in free],
+                      values, self.key)
+
+    def multiply(self, other):
+        """Returns product of the factor and the other factor."""
+        variables = list(self.variables)
+        cardinalities = list(self.cardinalities)
+        for v, c in zip(other.variables, other.cardinalities):
+            if v not in variables:
+                variables.append(v)
+                cardinalities.append(c)
+        a_strides = [self.stride(v) for v in variables]
+        b_strides = [other.stride(v) for v in variables]
+        values = []
+        for assignment in product(*[range(c) for c in cardinalities]):
+            i = j = 0
+            for a, s, t in zip(assignment, a_strides, b_strides):
+                i += a * s
+                j += a * t
+            values.append(self.values[i] * other.values[j])
+        return Factor(variables, cardinalities, values)
+
+    def sum_out(self, variable):
+        """Returns factor with the variable summed out."""
+        k = self.variables.index(variable)
+        stride = self.strides[k]
+        cardinality = self.cardinalities[k]
+        block = stride * cardinality
+        values = []
+        for start in range(0, len(self.values), block):
+            for i in range(start, start + stride):
+                total = 0.0
+                for j in range(i, i + block, stride):
+                    total += self.values[j]
+                values.append(total)
+        return Factor(self.variables[:k] + self.variables[k + 1:],
+                      self.cardinalities[:k] + self.cardinalities[k + 1:],
+                      values)
+
+
+def elimination_order(factors, keep, heuristic='min_fill'):
+    """Returns order of eliminating all the variables of factors but
+    those in keep, greedily chosen with the min_fill (fewest edges
+    added to the interaction graph) or min_degree (fewest neighbours)
+    heuristic."""
+    neighbours = {}
+    for f in factors:
+        for v in f.variables:
+            neighbours.setdefault(v, set()).update(f.variables)
+            neighbours[v].discard(v)
+    order = []
+    remaining = [v for v in neighbours if v not in keep]
+    while remaining:
+        def cost(v):
+            if heuristic == 'min_degree':
+                return len(neighbours[v])
+            n = list(neighbours[v])
+            return sum(1 for i, a in enumerate(n) for b in n[i + 1:]
+                       if b not in neighbours[a])
+        best = min(remaining, key=cost)
+        for a in neighbours[best]:
+            neighbours[a].update(neighbours[best])
+            neighbours[a].discard(a)
+            neighbours[a].discard(best)
+        del neighbours[best]
+        remaining.remove(best)
+        order.append(best)
+    return order
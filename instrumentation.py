@@ -0,0 +1,131 @@
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+from constants import CHAIN_BATCHES
+
+
+class Instrumentation:
+    """Used for collecting statistics of a sampler run: time spent in
+    its phases, numbers of phases entered, node visits and table
+    lookups, sampling speed and mixing of the chain. A sampler given no Instrumentation records nothing, so
+    there is next to no overhead when it is disabled."""
+
+    def __init__(self, callback=None):
+        self.callback = callback  # called with report() by finish()
+        self.timers = defaultdict(float)  # seconds spent in phases
+        self.calls = defaultdict(int)     # numbers of phases entered
+        self.visits = defaultdict(int)    # numbers of updates of nodes
+        self.changes = 0  # number of updates changing node's value
+        self.lookups = 0  # number of conditional probability lookups
+        self.steps = 0
+        # batch means of values of queried nodes:
+        self.traces = defaultdict(BatchMeans)
+
+    @contextmanager
+    def phase(self, name):
+        """Times the enclosed block as the named phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] += time.perf_counter() - start
+            self.calls[name] += 1
+
+    def record(self, nodes, changed, values, lookups=0):
+        """Records a step updating the nodes, given current values of
+        the queried nodes."""
+        self.steps += 1
+        for node in nodes:
+            self.visits[node] += 1
+        self.changes += changed
+        self.lookups += lookups
+        for q, value in values.items():
+            self.traces[q].add(value)
+
+    def report(self):
+        """Returns collected statistics as a dictionary."""
+        sampling = self.timers.get('sampling', 0.0)
+        return {
+            'timers': dict(self.timers),
+            'calls': dict(self.calls),
+            'cpt_lookups': self.lookups,
+            'visits': dict(self.visits),
+            'steps': self.steps,
+            'samples_per_second': self.steps / sampling if sampling else 0.0,
+            'acceptance': self.changes / self.steps if self.steps else 0.0,
+            'effective_sample_size': {q: t.effective_sample_size()
+                                      for q, t in self.traces.items()},
+        }
+
+    def finish(self):
+        """Passes report() to the callback, if any, and returns it."""
+        report = self.report()
+        if self.callback is not None:
+            self.callback(report)
+        return report
+
+
+class BatchMeans:
+    """Used for accumulating the trace of a node's values in a chain as
+    counts of values per batch of consecutive steps, at most
+    CHAIN_BATCHES of them, pairs being merged into batches twice as
+    long when full, so that memory use does not grow with the chain."""
+
+    def __init__(self):
+        self.batches = []  # counts of values of every complete batch
+        self.batch = {}    # counts of values of the current batch
+        self.size = 1      # steps per batch
+        self.filled = 0    # steps counted in the current batch
+        self.n = 0         # number of steps
+
+    def add(self, value):
+        """Accounts for a step of the chain taking value."""
+        self.batch[value] = self.batch.get(value, 0) + 1
+        self.n += 1
+        self.filled += 1
+        if self.filled < self.size:
+            return
+        self.batches.append(self.batch)
+        self.batch = {}
+        self.filled = 0
+        if len(self.batches) == CHAIN_BATCHES:
+            merged = []
+            for x, y in zip(self.batches[::2], self.batches[1::2]):
+                merged.append({v: x.get(v, 0) + y.get(v, 0)
+                               for v in set(x) | set(y)})
+            self.batches = merged
+            self.size *= 2
+
+    def effective_sample_size(self):
+        """Returns effective sample size of the estimate of every
+        value's probability, computed with the method of batch means
+        over the complete batches."""
+        values = set(self.batch).union(*self.batches)
+        n_batches = len(self.batches)
+        if n_batches < 2:
+            return {v: float(self.n) for v in values}
+        m = n_batches * self.size  # steps in complete batches
+        res = {}
+        for value in values:
+            x = [b.get(value, 0) / self.size for b in self.batches]
+            mean = sum(x) / n_batches
+            variance = m * mean * (1 - mean) / (m - 1)
+            b_variance = sum((a - mean) ** 2 for a in x) / (n_batches - 1)
+            if not b_variance:
+                res[value] = float(self.n)
+            else:
+                res[value] = min(float(self.n),
+                                 self.n * variance / (self.size * b_variance))
+        return res
+
+
+def effective_sample_size(trace):
+    """Returns effective sample size of the estimate of every value's
+    probability from the trace of a chain, computed with the method of
+    batch means."""
+    batch_means = BatchMeans()
+    for value in trace:
+        batch_means.add(value)
+    return batch_means.effective_sample_size()
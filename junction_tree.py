@@ -0,0 +1,152 @@
+from factor import Factor, elimination_order
+
+
+class JunctionTree:
+    """Used for storing a junction tree compiled from a bayesian
+    network: cliques of its moralized and triangulated graph, connected
+    into a tree, with conditional probability tables assigned to them.
+    Messages between cliques are computed lazily and kept until the
+    evidence on their sending side changes."""
+
+    def __init__(self, bayes_net, heuristic='min_fill'):
+        self.bayes_net = bayes_net
+        families = [bayes_net._cpt_factor(n, {}) for n in bayes_net.order]
+        self.cliques = self._triangulate(families, heuristic)
+        self.neighbours = self._connect(self.cliques)
+        self.potentials = []  # products of CPTs assigned to cliques
+        self.home = {}  # clique of every variable's evidence indicator
+        assigned = [[] for _ in self.cliques]
+        for f in families:
+            c = self._clique_of(f.variables)
+            assigned[c].append(f)
+            self.home[f.variables[-1]] = c
+        for factors in assigned:
+            potential = Factor([], [], [1.0])
+            for f in factors:
+                potential = potential.multiply(f)
+            self.potentials.append(potential)
+        self.evidence = {}  # value indices of observed variables
+        self.messages = {}  # messages keyed by (sender, receiver)
+
+    def set_evidence(self, evidence):
+        """Replaces evidence, given as value indices, invalidating only
+        the messages sent from the side of cliques whose evidence
+        changed."""
+        changed = {v for v in set(evidence) | set(self.evidence)
+                   if evidence.get(v) != self.evidence.get(v)}
+        self.evidence = dict(evidence)
+        for c in {self.home[v] for v in changed}:
+            # Invalidate all messages directed away from clique c:
+            stack = [(c, None)]
+            while stack:
+                a, previous = stack.pop()
+                for b in self.neighbours[a]:
+                    if b != previous:
+                        self.messages.pop((a, b), None)
+                        stack.append((b, a))
+
+    def calibrate(self):
+        """Computes all the messages of the tree."""
+        for a, neighbours in enumerate(self.neighbours):
+            for b in neighbours:
+                self._message(a, b)
+
+    def marginal(self, variable):
+        """Returns unnormalized distribution of the variable, given
+        the current evidence."""
+        c = self.home[variable]
+        belief = self._belief(c, None)
+        for v in list(belief.variables):
+            if v != variable:
+                belief = belief.sum_out(v)
+        return belief.values
+
+    def _belief(self, c, excluded):
+        """Returns product of clique's potential, evidence indicators and
+        messages from all the neighbours but the excluded one."""
+        belief = self.potentials[c]
+        for v, value in self.evidence.items():
+            if self.home[v] == c:
+                cardinality = len(self.bayes_net.nodes[v].values)
+                belief = belief.multiply(Factor(
+                    [v], [cardinality],
+                    [float(i == value) for i in range(cardinality)]))
+        for b in self.neighbours[c]:
+            if b != excluded:
+                belief = belief.multiply(self._message(b, c))
+        return belief
+
+    def _message(self, a, b):
+        """Returns message sent from clique a to clique b, computing
+        missing messages it depends on first."""
+        stack = [(a, b)]
+        while stack:
+            sender, receiver = stack[-1]
+            if (sender, receiver) in self.messages:
+                stack.pop()
+                continue
+            missing = [(k, sender) for k in self.neighbours[sender]
+                       if k != receiver and (k, sender) not in self.messages]
+            if missing:
+                stack += missing
+                continue
+            stack.pop()
+            message = self._belief(sender, receiver)
+            separator = self.cliques[receiver]
+            for v in list(message.variables):
+                if v not in separator:
+                    message = message.sum_out(v)
+            self.messages[(sender, receiver)] = message
+        return self.messages[(a, b)]
+
+    def _clique_of(self, variables):
+        """Returns index of the smallest clique containing variables."""
+        candidates = [i for i, c in enumerate(self.cliques)
+                      if all(v in c for v in variables)]
+        return min(candidates, key=lambda i: len(self.cliques[i]))
+
+    @staticmethod
+    def _triangulate(families, heuristic):
+        """Returns maximal cliques of the moral graph of families,
+        triangulated by eliminating variables in heuristic order."""
+        neighbours = {}
+        for f in families:
+            for v in f.variables:
+                neighbours.setdefault(v, set()).update(f.variables)
+                neighbours[v].discard(v)
+        cliques = []
+        for v in elimination_order(families, [], heuristic):
+            clique = neighbours[v] | {v}
+            for a in neighbours[v]:
+                neighbours[a] |= neighbours[v]
+                neighbours[a].discard(a)
+                neighbours[a].discard(v)
+            del neighbours[v]
+            if not any(clique <= c for c in cliques):
+                cliques = [c for c in cliques if not c <= clique]
+                cliques.append(clique)
+        return cliques
+
+    @staticmethod
+    def _connect(cliques):
+        """Returns neighbours of every clique in a maximum spanning tree
+        weighted by sizes of separators between cliques."""
+        edges = sorted(((len(a & b), i, j) for i, a in enumerate(cliques)
+                        for j, b in enumerate(cliques) if i < j),
+                       reverse=True)
+        component = list(range(len(cliques)))
+
+        def find(i):
+            while component[i] != i:
+                component[i] = component[component[i]]
+                i = component[i]
+            return i
+
+        neighbours = [[] for _ in cliques]
+        for _, i, j in edges:
+            a, b = find(i), find(j)
+            if a != b:
+                component[a] = b
+                neighbours[i].append(j)
+                neighbours[j].append(i)
+        return neighbours
@@ -0,0 +1,146 @@
+"""Learning conditional probability tables of a bayesian network of
+known structure from a csv file of complete observations.
+
+The file is read in chunks of rows, whose parent/child value
+co-occurrences are counted in a pool of worker processes, so memory
+use is bounded by the chunk size and the sizes of the tables, not by
+the size of the file."""
+import argparse
+import csv
+import json
+import os
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+from constants import NODES, RELATIONS, PARENTS, PROBABILITIES
+
+
+def count(rows, families):
+    """Returns Counters of value tuples, parents' values followed by
+    child's value, of every family given as a list of column indices
+    of parents followed by the child."""
+    counters = []
+    for columns in families:
+        counters.append(Counter(tuple(row[c] for c in columns)
+                                for row in rows))
+    return counters
+
+
+def read_chunks(filename, chunk_size):
+    """Yields the header of the csv file, then lists of at most
+    chunk_size of its rows."""
+    with open(filename, newline='') as file:
+        reader = csv.reader(file)
+        yield next(reader)
+        chunk = []
+        for row in reader:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def count_file(structure, filename, chunk_size=100000, workers=None):
+    """Returns Counters of value tuples of every node's family, nodes and
+    their parents given by structure, a dictionary, over rows of the
+    csv file, whose header names the nodes. Chunks are counted in
+    a pool of workers processes, at most two per worker in flight, or
+    in this process if workers is 1."""
+    chunks = read_chunks(filename, chunk_size)
+    header = next(chunks)
+    for node in structure:
+        if node not in header:
+            raise ValueError('Column \"' + node + '\" not found.')
+    column = {name: i for i, name in enumerate(header)}
+    families = [[column[p] for p in parents] + [column[node]]
+                for node, parents in structure.items()]
+    totals = [Counter() for _ in families]
+
+    def merge(counters):
+        for total, counter in zip(totals, counters):
+            total.update(counter)
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for chunk in chunks:
+            merge(count(chunk, families))
+        return totals
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = []
+        for chunk in chunks:
+            in_flight.append(pool.submit(count, chunk, families))
+            if len(in_flight) >= 2 * workers:
+                merge(in_flight.pop(0).result())
+        for future in in_flight:
+            merge(future.result())
+    return totals
+
+
+def learn(structure, filename, alpha=1.0, values=None, chunk_size=100000,
+          workers=None):
+    """Returns network in the json format, with structure, a dictionary
+    of nodes' parents, and conditional probability tables estimated
+    from the csv file. Counts are smoothed with a Dirichlet prior of
+    alpha pseudo-counts per value (alpha=1 is Laplace smoothing);
+    parent values never observed, with alpha=0, get uniform
+    distributions. Nodes' values are those observed, unless given in
+    values, a dictionary."""
+    counters = count_file(structure, filename, chunk_size, workers)
+    observed = {}
+    for (node, parents), counter in zip(structure.items(), counters):
+        for key in counter:
+            observed.setdefault(node, set()).add(key[-1])
+            for parent, value in zip(parents, key):
+                observed.setdefault(parent, set()).add(value)
+    values = dict(values or {})
+    for node in structure:
+        if node not in values:
+            values[node] = sorted(observed.get(node, []))
+    relations = {}
+    for (node, parents), counter in zip(structure.items(), counters):
+        probabilities = {}
+        for assignment in product(*[values[p] for p in parents]):
+            n = [counter[assignment + (v,)] + alpha for v in values[node]]
+            total = sum(n)
+            for v, c in zip(values[node], n):
+                key = ','.join(assignment + (v,))
+                probabilities[key] = (c / total if total
+                                      else 1.0 / len(values[node]))
+        relations[node] = {PARENTS: list(parents),
+                           PROBABILITIES: probabilities}
+    return {NODES: list(structure), RELATIONS: relations}
+
+
+def read_structure(filename):
+    """Returns dictionary of nodes' parents read from a network json
+    file; probabilities in it, if any, are ignored."""
+    with open(filename, 'r') as file:
+        data = json.load(file)
+    return {n: data[RELATIONS][n][PARENTS] for n in data[NODES]}
+
+
+def parse_arguments():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("structure",
+                    help='json file of the network, parents are used')
+    ap.add_argument("data", help='csv file with a header of node names')
+    ap.add_argument("-o", "--output", required=True,
+                    help='json file for the learnt network')
+    ap.add_argument("-a", "--alpha", type=float, default=1.0,
+                    help='pseudo-count of every value, default 1.0')
+    ap.add_argument("-c", "--chunk-size", type=int, default=100000)
+    ap.add_argument("-w", "--workers", type=int,
+                    help='number of worker processes')
+    return ap.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    network = learn(read_structure(args.structure), args.data, args.alpha,
+                    chunk_size=args.chunk_size, workers=args.workers)
+    with open(args.output, 'w') as file:
+        json.dump(network, file, indent=4)
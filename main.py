@@ -2,6 +2,7 @@ import sys
 import ast
 import argparse
 from bayes_net import BayesNet
+from result_cache import ResultCache
 
 class Interface:
     '''Container for user input data'''
@@ -10,11 +11,12 @@ class Interface:
         self.query = []
         self.steps = 1000
         self.bayes_net = bayes_net
+        self.result_cache = ResultCache()
 
 def create_bayes_net_from_file(args):
     bayes_net = BayesNet()
 
-    if bayes_net.load(args['file']):
+    if bayes_net.load(args['file'], compact=args['compact']):
         print("File loaded successfully.")
         return bayes_net
     else:
@@ -51,6 +53,14 @@ def parse_arguments():
         help='for example: -s 123456'
     )
     
+    ap.add_argument(
+        "-c",
+        "--compact",
+        required=False,
+        help='store the network in compact form',
+        action='store_true'
+    )
+
     ap.add_argument(
         "-i",
         "--interactive",
@@ -73,6 +83,7 @@ def print_menu():
             '\tsteps <number>              = sets number of steps, default 1000\n'
             '\tnetwork                     = prints the network loaded from file\n'
             '\tMCMC or mcmc                = mcmc using evidence, query, steps\n'
+            '\texact                       = exact inference using evidence, query\n'
             '\texit                        = exits the program\n'
             '\thelp                        = displays this message\n'
         )
@@ -121,7 +132,8 @@ def mcmc(interface):
     MCMC(interface)
 
 def MCMC(interface):
-    answer = interface.bayes_net.mcmc(
+    answer = interface.result_cache.mcmc(
+        interface.bayes_net,
         ev=interface.evidence,
         query=interface.query,
         steps=interface.steps
@@ -131,6 +143,16 @@ def MCMC(interface):
     print("Obtained in", interface.steps, "steps is:")
     print(answer)
 
+def exact(interface):
+    answer = interface.bayes_net.query_exact(
+        ev=interface.evidence,
+        query=interface.query
+        )
+    print("The exact probability of:", interface.query)
+    print("Given that:", interface.evidence)
+    print("is:")
+    print(answer)
+
 def call_selected_function(user_input, interface):
     try:
         globals()[user_input[0]](*user_input[1:], interface)
@@ -196,6 +218,7 @@ if __name__ == '__main__':
                    "network",
                    "mcmc",
                    "MCMC",
+                   "exact",
                    "exit",
                    "remove_query",
                    "print_query",
@@ -0,0 +1,54 @@
+from collections import OrderedDict
+
+
+class MarkovBlanketCache:
+    """Used for storing normalized conditional distributions of nodes,
+    keyed by the values their Markov blankets take. Entries are computed
+    lazily, on the first visit of a given blanket state; each node keeps
+    at most size entries, the least recently used being evicted first."""
+
+    def __init__(self, bayes_net, size=4096):
+        self.bayes_net = bayes_net
+        self.size = size
+        self.blankets = {}  # Markov blanket of every visited node
+        self.entries = {}   # OrderedDict of distributions for every node
+
+    def __len__(self):
+        return sum(len(e) for e in self.entries.values())
+
+    def get(self, node, evidence):
+        """Returns node's values and their cumulative probabilities,
+        conditioned on node's Markov blanket taking values from the
+        evidence list."""
+        if node not in self.blankets:
+            self.blankets[node] = self.bayes_net.markov_blanket(node)
+        key = tuple(evidence[n] for n in self.blankets[node])
+        distribution = self.lookup(node, key)
+        if distribution is None:
+            distribution = self.bayes_net.mb_distribution(node, evidence)
+            self.store(node, key, distribution)
+        return distribution
+
+    def lookup(self, node, key):
+        """Returns distribution of node stored under the key of its
+        Markov blanket's state, None if there is none."""
+        entries = self.entries.get(node)
+        if entries is None:
+            return None
+        distribution = entries.get(key)
+        if distribution is not None:
+            entries.move_to_end(key)
+        return distribution
+
+    def store(self, node, key, distribution):
+        """Stores distribution of node under the key of its Markov
+        blanket's state, evicting the least recently used one if there
+        are too many."""
+        entries = self.entries.setdefault(node, OrderedDict())
+        entries[key] = distribution
+        if len(entries) > self.size:
+            entries.popitem(last=False)
+
+    def clear(self):
+        self.blankets = {}
+        self.entries = {}
@@ -1,19 +1,46 @@
 import random
-from random import choice
+from array import array
+from sys import intern
 
-from constants import PARENTS, PROBABILITIES
-from utils import indent, quicksort
+from constants import PARENTS, PROBABILITIES, TOLERANCE
+from utils import indent
+from utils import ConditionalProbability
 
 
 class Node:
     """Used for storing a representation of bayesian network node"""
 
+    __slots__ = ('parents', '_probabilities', 'values', 'value_index',
+                 'parent_index', 'parent_values', 'strides', 'table', 'rows')
+
     def __init__(self, parents=[], probabilities=[], values=[]):
         self.parents = parents  # list of Node's parents
         # list of ConditionalProbability objects for conditional
         # probabilities of events in Node:
         self.probabilities = probabilities
         self.values = values    # list of Node's possible values
+        # maps Node's values to their indices:
+        self.value_index = {v: i for i, v in enumerate(values)}
+        # dense table of conditional probabilities built by compile():
+        self.parent_index = []  # value_index of each of Node's parents
+        self.parent_values = []  # values of each of Node's parents
+        self.strides = []       # mixed-radix strides of Node's parents
+        self.table = []         # flat list of conditional probabilities
+        # offsets in table of the probabilities, set by compact():
+        self.rows = None
+
+    @property
+    def probabilities(self):
+        """List of ConditionalProbability objects, materialized from
+        the compiled table when the node is compact."""
+        if self.rows is None:
+            return self._probabilities
+        return [self._row(offset) for offset in self.rows]
+
+    @probabilities.setter
+    def probabilities(self, probabilities):
+        self._probabilities = probabilities
+        self.rows = None
 
     def __str__(self):
         n_values = len(self.values)
@@ -40,9 +67,10 @@ class Node:
         """Returns probabilities of given events chain."""
         return self.probabilities[events]
 
-    def random(self):
-        """Returns value drawn from self.values."""
-        return choice(self.values)
+    def random(self, rng=random):
+        """Returns value drawn from self.values, using rng, a Random
+        instance or the random module."""
+        return rng.choice(self.values)
 
     def _r(self):
         s = 0.0
@@ -62,36 +90,116 @@ class Node:
 
     def sort(self):
         """Sorts probabilities by their children values, then by their
-        parents values, in alphabetical order"""
-        self.probabilities = quicksort(self.probabilities)
+        parents values, in alphabetical order. Compact nodes keep their
+        probabilities sorted already."""
+        if self.rows is None:
+            self.probabilities = sorted(self.probabilities)
+
+    def compile(self, parent_nodes):
+        """Builds a dense table of the node's conditional probabilities.
+        Values of the node and of its parents are mapped to integers, so
+        that probability of the node taking value v, under condition of
+        parents taking values p_1...p_k, is stored under index
+        v + p_1 * strides[0] + ... + p_k * strides[k - 1].
+        Combinations absent from the probability table are set to 0.0.
+        Compact nodes stay compact, their probabilities being read from
+        the table before it is rebuilt."""
+        probabilities = self.probabilities
+        self.table = [0.0] * self.layout(parent_nodes)
+        rows = []
+        for p in probabilities:
+            offset = self._offset(p)
+            if offset is not None:
+                self.table[offset] = p.probability
+                rows.append(offset)
+        if self.rows is not None:
+            self.rows = array('l', rows)
+            self.table = array('d', self.table)
+
+    def layout(self, parent_nodes):
+        """Computes indices and strides of the node's parents values,
+        returns size of the dense table."""
+        self.parent_index = [p.value_index for p in parent_nodes]
+        self.parent_values = [p.values for p in parent_nodes]
+        self.strides = []
+        stride = len(self.values)
+        for p in reversed(parent_nodes):
+            self.strides.insert(0, stride)
+            stride *= len(p.values)
+        return stride
+
+    def compact(self):
+        """Switches the compiled node to compact storage: values and
+        parents become tuples of interned strings, the table an array
+        of doubles, and ConditionalProbability objects are dropped in
+        favour of their offsets in the table."""
+        if self.rows is not None:
+            return
+        self.values = tuple(intern(v) for v in self.values)
+        self.parents = tuple(intern(p) for p in self.parents)
+        self.value_index = {v: i for i, v in enumerate(self.values)}
+        self.parent_values = [tuple(intern(v) for v in values)
+                              for values in self.parent_values]
+        offsets = [self._offset(p) for p in self._probabilities]
+        self.rows = array('l', [o for o in offsets if o is not None])
+        self.table = array('d', self.table)
+        self._probabilities = None
+
+    def __getstate__(self):
+        """Returns state for pickling, with tables mapped from a file
+        copied into arrays."""
+        state = {s: getattr(self, s) for s in self.__slots__}
+        for s in ('table', 'rows'):
+            if isinstance(state[s], memoryview):
+                state[s] = array(state[s].format, state[s])
+        return None, state
+
+    def _offset(self, probability):
+        """Returns offset of the ConditionalProbability in the table,
+        None if its values are not known."""
+        p = probability
+        parents_values = p.parents.split(',') if p.parents else []
+        if len(parents_values) != len(self.parent_index):
+            return None
+        offset = self.value_index[p.child]
+        for value, index, s in zip(parents_values, self.parent_index,
+                                   self.strides):
+            if value not in index:
+                return None
+            offset += index[value] * s
+        return offset
+
+    def _row(self, offset):
+        """Returns ConditionalProbability stored at offset in the
+        table."""
+        parents_values = [values[(offset // s) % len(values)]
+                          for values, s in zip(self.parent_values,
+                                               self.strides)]
+        return ConditionalProbability(','.join(parents_values),
+                                      self.values[offset % len(self.values)],
+                                      self.table[offset])
 
     def validate(self):
         """Evaluates to True if the node has defined probabilities
         and the probability tables are correct, according to notation
         and requirements from EARIN Exercise 5. Otherwise evaluates
-        to False."""
-        self.sort()
-
+        to False. Probabilities are grouped by their parents values in
+        a single pass; each group has to sum up to 1.0 within
+        TOLERANCE."""
         msg = ''
 
-        sum_iter = 0
-        p_sum = 0
-        n_values = len(self.values)
-
         if not self.probabilities:
             msg += 'No probabilities assigned.'
             return False, msg
 
+        sums = {}
         for p in self.probabilities:
-            sum_iter += 1
-            p_sum += p.probability
-            if sum_iter == n_values:
-                if p_sum != 1:
-                    msg += ('In parent probability(-ies) \"' + p.parents
-                            + '\" total probability is not 1.0.\n'
-                            + 'Total probability: ' + str(p_sum))
-                    return False, msg
-                sum_iter = 0
-                p_sum = 0
+            sums[p.parents] = sums.get(p.parents, 0.0) + p.probability
+        for parents, p_sum in sums.items():
+            if abs(p_sum - 1) > TOLERANCE:
+                msg += ('In parent probability(-ies) \"' + parents
+                        + '\" total probability is not 1.0.\n'
+                        + 'Total probability: ' + str(p_sum))
+                return False, msg
 
         return True, msg
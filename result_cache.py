@@ -0,0 +1,78 @@
+import os
+import pickle
+import time
+
+from collections import OrderedDict
+
+
+class ResultCache:
+    """Used for storing chains of answered mcmc queries, keyed by the
+    fingerprint of the network, the evidence and the query. At most
+    size entries are kept, the least recently used being evicted
+    first, and entries older than ttl seconds expire. Cached estimates
+    asked for with more steps are refined by resuming their chains.
+    When path is given, entries are loaded from it and save() writes
+    them back."""
+
+    def __init__(self, size=1024, ttl=None, path=None):
+        self.size = size
+        self.ttl = ttl
+        self.path = path
+        self.entries = OrderedDict()  # (time of creation, Chain) tuples
+        if path and os.path.isfile(path):
+            with open(path, 'rb') as file:
+                self.entries = pickle.load(file)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(bayes_net, ev, query):
+        return (bayes_net.fingerprint(), tuple(sorted(ev.items())),
+                tuple(sorted(set(query))))
+
+    def get(self, key):
+        """Returns Chain stored under key, None if absent or expired."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        created, chain = entry
+        if self.ttl is not None and time.time() - created > self.ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return chain
+
+    def put(self, key, chain):
+        created = self.entries[key][0] if key in self.entries else time.time()
+        self.entries[key] = (created, chain)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def mcmc(self, bayes_net, ev={}, query=[], steps=1000):
+        """Returns probability estimates for each query, like
+        BayesNet.mcmc, obtained from at least steps steps of a cached
+        chain. Missing steps are sampled and cached. Raises ValueError
+        unless steps is positive."""
+        if steps < 1:
+            raise ValueError('steps must be positive, got ' + str(steps))
+        key = self.key(bayes_net, ev, query)
+        chain = self.get(key)
+        if chain is None:
+            chain = next(bayes_net.mcmc_iter(ev, key[2], steps, steps))
+        elif chain.steps < steps:
+            missing = steps - chain.steps
+            chain = next(bayes_net.mcmc_iter(every=missing, steps=missing,
+                                             chain=chain))
+        self.put(key, chain)
+        estimates = chain.estimates()
+        return {q: estimates[q] for q in query}
+
+    def clear(self):
+        self.entries.clear()
+
+    def save(self):
+        """Writes the entries into the file at path."""
+        with open(self.path, 'wb') as file:
+            pickle.dump(self.entries, file)
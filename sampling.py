@@ -0,0 +1,145 @@
+"""Writing samples of the joint distribution of a bayesian network to
+files, to be used as synthetic data, and scoring files of complete
+assignments with their log-likelihoods.
+
+Samples are generated and written in chunks, so files of any number of
+samples are written in bounded memory. Csv files have a header of node
+names and rows of their values; .npy files, readable with numpy.load,
+hold a matrix of indices of values, one column per node in the order
+of BayesNet.order. Files are scored in chunks as well."""
+import argparse
+import ast
+import csv
+import sys
+
+from array import array
+from itertools import chain, islice
+
+from bayes_net import BayesNet
+from constants import SAMPLES_CHUNK
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+# typecodes of unsigned arrays and their .npy dtypes, smallest first:
+DTYPES = [('B', '|u1'), ('H', '<u2'), ('I', '<u4')]
+# typecodes of integer .npy dtypes, regardless of byte order:
+TYPECODES = {'u1': 'B', 'u2': 'H', 'u4': 'I', 'u8': 'Q',
+             'i1': 'b', 'i2': 'h', 'i4': 'i', 'i8': 'q'}
+
+
+def npy_header(dtype, shape):
+    """Returns header of a .npy file, version 1.0, of a C-ordered array
+    of the given dtype and shape."""
+    header = repr({'descr': dtype, 'fortran_order': False,
+                   'shape': tuple(shape)})
+    length = len(NPY_MAGIC) + 2 + len(header) + 1
+    header += ' ' * (-length % 64) + '\n'
+    return (NPY_MAGIC + len(header).to_bytes(2, 'little')
+            + header.encode('latin1'))
+
+
+def read_npy_header(file):
+    """Returns dtype, shape and fortran order flag read from the header
+    of an open .npy file, which is left positioned at the data."""
+    magic = file.read(8)
+    if magic[:6] != NPY_MAGIC[:6]:
+        raise ValueError('Not a .npy file.')
+    size = 2 if magic[6] == 1 else 4
+    length = int.from_bytes(file.read(size), 'little')
+    header = ast.literal_eval(file.read(length).decode('latin1'))
+    return header['descr'], header['shape'], header['fortran_order']
+
+
+def write_csv(bayes_net, filename, n, chunk_size=SAMPLES_CHUNK, rng=None):
+    """Writes n samples of the network to a csv file."""
+    values = [bayes_net.nodes[name].values for name in bayes_net.order]
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(bayes_net.order)
+        for columns in bayes_net.sample(n, chunk_size, rng):
+            columns = [[vs[v] for v in column]
+                       for vs, column in zip(values, columns)]
+            writer.writerows(zip(*columns))
+
+
+def write_npy(bayes_net, filename, n, chunk_size=SAMPLES_CHUNK, rng=None):
+    """Writes n samples of the network to a .npy file, as a matrix of
+    indices of values of the smallest unsigned type holding them."""
+    largest = max(len(node.values) for node in bayes_net.nodes.values())
+    for typecode, dtype in DTYPES:
+        if largest <= 1 << 8 * array(typecode).itemsize:
+            break
+    with open(filename, 'wb') as file:
+        file.write(npy_header(dtype, (n, len(bayes_net.order))))
+        for columns in bayes_net.sample(n, chunk_size, rng):
+            data = array(typecode, chain.from_iterable(zip(*columns)))
+            if sys.byteorder == 'big':
+                data.byteswap()
+            data.tofile(file)
+
+
+def read_npy(filename, chunk_size=SAMPLES_CHUNK):
+    """Yields chunks of at most chunk_size rows of the integer matrix
+    stored in a .npy file, each chunk as a list of its columns."""
+    with open(filename, 'rb') as file:
+        dtype, shape, fortran_order = read_npy_header(file)
+        if fortran_order or len(shape) != 2 or dtype[1:] not in TYPECODES:
+            raise ValueError('Unsupported .npy array: ' + dtype + ', '
+                             + str(shape) + '.')
+        swap = dtype[0] in '<>' and dtype[0] != '<>'[sys.byteorder == 'big']
+        n_rows, n_columns = shape
+        for start in range(0, n_rows, chunk_size):
+            data = array(TYPECODES[dtype[1:]])
+            data.fromfile(file, min(chunk_size, n_rows - start) * n_columns)
+            if swap:
+                data.byteswap()
+            yield [data[j::n_columns] for j in range(n_columns)]
+
+
+def read_csv(bayes_net, filename, chunk_size=SAMPLES_CHUNK):
+    """Yields chunks of at most chunk_size rows of a csv file with
+    a header of node names and rows of their values, each chunk as
+    a list of columns of indices of values, ordered as bayes_net.order."""
+    with open(filename, newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        columns = [header.index(name) for name in bayes_net.order]
+        indices = [bayes_net.nodes[name].value_index
+                   for name in bayes_net.order]
+        while True:
+            rows = list(islice(reader, chunk_size))
+            if not rows:
+                return
+            yield [[index[row[c]] for row in rows]
+                   for c, index in zip(columns, indices)]
+
+
+def score(bayes_net, filename, chunk_size=SAMPLES_CHUNK):
+    """Yields lists of log-likelihoods of chunks of at most chunk_size
+    complete assignments stored in a .npy or csv file, in the formats
+    written by write_npy and write_csv."""
+    if filename.endswith('.npy'):
+        chunks = read_npy(filename, chunk_size)
+    else:
+        chunks = read_csv(bayes_net, filename, chunk_size)
+    for columns in chunks:
+        yield bayes_net.log_likelihood(columns)
+
+
+def parse_arguments():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("file", help='json file of the network')
+    ap.add_argument("samples", type=int, help='number of samples')
+    ap.add_argument("-o", "--output", required=True,
+                    help='.csv or .npy file for the samples')
+    ap.add_argument("-c", "--chunk-size", type=int, default=SAMPLES_CHUNK)
+    ap.add_argument("-s", "--seed", type=int)
+    return ap.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    bayes_net = BayesNet()
+    if not bayes_net.load(args.file):
+        sys.exit(-1)
+    write = write_npy if args.output.endswith('.npy') else write_csv
+    write(bayes_net, args.output, args.samples, args.chunk_size, args.seed)
@@ -0,0 +1,150 @@
+"""Asyncio server answering inference queries against networks loaded
+once at startup.
+
+Clients connect over TCP and send one json request per line, e.g.:
+
+    {"id": 1, "network": "alarm.json", "method": "mcmc",
+     "evidence": {"burglary": "T"}, "query": ["John_calls"], "steps": 10000}
+
+and receive one json response per line, either
+{"id": 1, "result": {...}} or {"id": 1, "error": "..."}. Supported
+methods are mcmc (the default) and exact. Sampling runs in a pool of
+worker processes, so the event loop never blocks; identical requests
+in flight are answered by a single computation."""
+import argparse
+import asyncio
+import json
+
+from concurrent.futures import ProcessPoolExecutor
+
+from bayes_net import BayesNet
+
+METHODS = ['mcmc', 'exact']
+
+_networks = None  # networks of the current worker process
+
+
+def _init_worker(networks):
+    """Stores the networks in a worker process."""
+    global _networks
+    _networks = networks
+
+
+def _infer(network, method, ev, query, steps):
+    """Answers a request in a worker process."""
+    bayes_net = _networks[network]
+    if method == 'exact':
+        return bayes_net.query_exact(ev, query)
+    return bayes_net.mcmc(ev, query, steps)
+
+
+class InferenceServer:
+    """Used for serving inference requests against loaded networks."""
+
+    def __init__(self, filenames, workers=None):
+        self.networks = {}
+        for filename in filenames:
+            bayes_net = BayesNet()
+            if not bayes_net.load(filename):
+                raise ValueError(filename + ' could not be loaded')
+            self.networks[filename] = bayes_net
+        self.pool = ProcessPoolExecutor(max_workers=workers,
+                                        initializer=_init_worker,
+                                        initargs=(self.networks,))
+        self.in_flight = {}  # futures of requests being computed
+
+    async def answer(self, request):
+        """Returns result of the request, a dictionary."""
+        network = request.get('network')
+        if network not in self.networks:
+            network = next(iter(self.networks)) if network is None else None
+        if network is None:
+            raise ValueError('unknown network ' + str(request['network']))
+        method = request.get('method', 'mcmc')
+        if method not in METHODS:
+            raise ValueError('unknown method ' + str(method))
+        ev = request.get('evidence', {})
+        query = request.get('query', [])
+        steps = int(request.get('steps', 1000))
+        nodes = self.networks[network].nodes
+        for name in list(ev) + list(query):
+            if name not in nodes:
+                raise ValueError(str(name) + ' is not a valid node')
+        key = (network, method, tuple(sorted(ev.items())), tuple(query),
+               steps if method == 'mcmc' else None)
+        future = self.in_flight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.pool, _infer, network, method,
+                                          ev, query, steps)
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # shielded, so that a client leaving does not cancel the others:
+        return await asyncio.shield(future)
+
+    async def respond(self, line, writer, lock):
+        """Answers a single request line and writes the response."""
+        request = {}
+        try:
+            request = json.loads(line)
+            response = {'result': await self.answer(request)}
+        except Exception as error:
+            response = {'error': str(error)}
+        if isinstance(request, dict) and 'id' in request:
+            response['id'] = request['id']
+        async with lock:
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+
+    async def handle(self, reader, writer):
+        """Serves a client connection; its requests are answered
+        concurrently, responses are written as soon as they are ready."""
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.create_task(self.respond(line, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def parse_arguments():
+    ap = argparse.ArgumentParser(description=__doc__,
+                                 formatter_class=argparse.
+                                 RawDescriptionHelpFormatter)
+    ap.add_argument("files", nargs='+',
+                    help='json files containing bayesian networks')
+    ap.add_argument("--host", default='127.0.0.1')
+    ap.add_argument("-p", "--port", type=int, default=8765)
+    ap.add_argument("-w", "--workers", type=int,
+                    help='number of worker processes')
+    return ap.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    inference_server = InferenceServer(args.files, args.workers)
+    print('Serving on', args.host + ':' + str(args.port))
+    try:
+        asyncio.run(inference_server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        inference_server.close()
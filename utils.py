@@ -1,4 +1,7 @@
+import hashlib
+import math
 import os
+import random
 
 from constants import INDENT
 
@@ -7,6 +10,8 @@ class ConditionalProbability:
     """Used for storing atomized key values and corresponding
     probabilities."""
 
+    __slots__ = ('parents', 'child', 'probability')
+
     def __init__(self, parents, child, probability):
         self.parents = parents
         self.child = child
@@ -50,6 +55,73 @@ def quicksort(array):
     return array
 
 
+def normalize(counters):
+    """Normalizes counters of every variable, so that they form
+    a probability distribution."""
+    s = dict.fromkeys(counters.keys(), 0.0)
+    for c, v in counters.items():
+        for p in v.values():
+            s[c] += p
+    for c, v in counters.items():
+        for k in v.keys():
+            counters[c][k] /= s[c]
+    return counters
+
+
+def max_standard_error(counts, n):
+    """Returns the largest standard error of probabilities estimated
+    from counts of values of every variable, given n effective
+    samples."""
+    res = 0.0
+    for count in counts.values():
+        s = sum(count)
+        if not s:
+            continue
+        for c in count:
+            p = c / s
+            res = max(res, math.sqrt(p * (1 - p) / n))
+    return res
+
+
+def draw(probabilities, offset, n, rng=random):
+    """Returns index of value drawn from n probabilities stored in the
+    list starting at offset."""
+    random_value = rng.random()
+    for i in range(n - 1):
+        random_value -= probabilities[offset + i]
+        if random_value < 0:
+            return i
+    return n - 1
+
+
+def make_rng(rng=None):
+    """Returns source of random numbers for samplers: the random module
+    for None, a new Random instance seeded with rng for an integer,
+    or rng itself otherwise. Samplers given equal seeds draw equal
+    numbers, regardless of other users of the random module."""
+    if rng is None:
+        return random
+    if isinstance(rng, int):
+        return random.Random(rng)
+    return rng
+
+
+def spawn(seed, n):
+    """Returns n seeds of independent streams derived from seed, each
+    one a hash of seed and the number of the stream."""
+    seeds = []
+    for i in range(n):
+        digest = hashlib.sha256((str(seed) + ':' + str(i)).encode())
+        seeds.append(int.from_bytes(digest.digest()[:8], 'little'))
+    return seeds
+
+
+def rng_batch(rng, n):
+    """Returns list of n uniform numbers drawn from rng."""
+    r = rng.random
+    return [r() for _ in range(n)]
+
+
 def split_key(key):
     """Splits the key of probabilities dictionary according to notation
     proposed in EARIN Exercise 5. Returned values: